@@ -0,0 +1,232 @@
+"""批量生成全部病种的分析报告（不需要启动 Streamlit）
+
+用法：
+    python batch_report.py 病种详情.xlsx --cases 病例详情.xlsx --consumables 耗材1.xlsx 耗材2.xlsx --out reports
+
+每个病种生成一个 HTML 页面（科室饼图、各科室诊疗组饼图、文字汇总，有病例/耗材文件时附病例表和耗材汇总），
+另外生成 index.html（亏损排行及各病种链接）和 汇总.xlsx。
+"""
+import argparse
+import html
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+import pandas as pd
+from plotly.offline import get_plotlyjs
+
+from case_index import CaseIndex
+from charts import department_pie, group_pie, more_losses_figure, summary_text, top_losses_figure
+from consumable_ingest import ingest_consumable_files
+from disease_cube import DiseaseCube
+from patient_index import ConsumableIndex, patient_key, summarize_consumables
+from schema import compact, select_columns_sql
+
+
+CASE_COLUMNS = ['DRG编码', '姓名', '分类', '出院科别', '实际住院天数', '预测盈亏', 'DRG名称']
+
+# 工作进程内共享的数据，由 _init_worker 在进程启动时设置一次
+_cube = None
+_cases = None
+_consumables = None
+_out_dir = None
+
+
+def load_inputs(disease_path, case_path=None, consumable_paths=(), workers=None):
+    """读取三类输入，返回 (DiseaseCube, CaseIndex 或 None, ConsumableIndex 或 None)"""
+    df = pd.read_excel(disease_path)
+    df['耗材超标值（元）'] = pd.to_numeric(df['耗材超标值（元）'], errors='coerce')
+    cube = DiseaseCube(compact(df, '病种'))
+
+    cases = CaseIndex(compact(pd.read_excel(case_path), '病例')) if case_path else None
+
+    consumables = None
+    if consumable_paths:
+        conn = sqlite3.connect(':memory:')
+        ingest_consumable_files(conn, list(consumable_paths), workers=workers)
+        frame = pd.read_sql(
+            f'SELECT {select_columns_sql(conn, "耗材详情", "耗材")} FROM 耗材详情 ORDER BY 患者键 IS NULL, 患者键', conn
+        )
+        conn.close()
+        consumables = ConsumableIndex(compact(frame, '耗材'))
+    return cube, cases, consumables
+
+
+def report_filename(position, name):
+    # 病种名称里可能有 / 等不能用作文件名的字符
+    safe = re.sub(r'[\\/:*?"<>|\s]+', '_', str(name))
+    return f'{position:04d}_{safe}.html'
+
+
+def _init_worker(cube, cases, consumables, out_dir):
+    global _cube, _cases, _consumables, _out_dir
+    _cube, _cases, _consumables, _out_dir = cube, cases, consumables, out_dir
+
+
+def _figure_html(fig):
+    return fig.to_html(full_html=False, include_plotlyjs=False)
+
+
+def _table_html(frame):
+    return frame.to_html(index=False, border=0, classes='table', na_rep='')
+
+
+def render_disease(position, name):
+    """渲染一个病种的 HTML 页面，返回写入 汇总.xlsx 的三部分明细"""
+    started = time.perf_counter()
+    departments = _cube.departments(name)
+    parts = [f'<h1>{html.escape(str(name))}</h1>']
+
+    totals = _cube.totals(name)
+    try:
+        lines = summary_text(totals)
+    except (KeyError, ValueError, ZeroDivisionError):
+        lines = ['数据不完整，无法生成文字汇总']
+    parts += [f'<p>{html.escape(line)}</p>' for line in lines]
+
+    if not departments.empty:
+        parts.append(_figure_html(department_pie(departments)))
+
+    group_rows = []
+    for department in departments['科室']:
+        groups = _cube.groups(name, department)
+        if groups is None or groups.empty:
+            continue
+        parts.append(_figure_html(group_pie(groups, department)))
+        group_rows.append(groups.assign(名称=name, 科室=department))
+
+    if _cases is not None:
+        case_drg = _cases.drg(name)
+        parts.append(f'<h2>病例（{len(case_drg)} 例）</h2>')
+        parts.append(_table_html(case_drg[[c for c in CASE_COLUMNS if c in case_drg.columns]]))
+
+        if _consumables is not None and not case_drg.empty:
+            keys = [(patient_key(code), patient) for code, patient in zip(case_drg['病案号'], case_drg['姓名'])]
+            rows = [_consumables.lookup(key, patient) for key, patient in keys if key is not None]
+            rows = [r for r in rows if not r.empty]
+            if rows:
+                summary = summarize_consumables(pd.concat(rows, ignore_index=True))
+                summary = summary.sort_values('AMT_HC总和', ascending=False)
+                parts.append('<h2>耗材使用汇总</h2>')
+                parts.append(_table_html(summary[['项目代码', '项目名称', '数量', 'AMT_HC总和']]))
+
+    filename = report_filename(position, name)
+    with open(os.path.join(_out_dir, filename), 'w', encoding='utf-8') as f:
+        f.write(_page(str(name), ''.join(parts)))
+
+    summary_row = {'名称': name, '报告': filename, '文字汇总': '\n'.join(lines)}
+    summary_row.update({k: v for k, v in totals.items()})
+    return {
+        'summary': summary_row,
+        'departments': departments.assign(名称=name),
+        'groups': pd.concat(group_rows, ignore_index=True) if group_rows else None,
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def _page(title, body):
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8">'
+        f'<title>{html.escape(title)}</title>'
+        '<script src="plotly.min.js"></script>'
+        '<style>body{font-family:sans-serif;margin:2em}.table td,.table th{padding:2px 8px}</style>'
+        f'</head><body>{body}</body></html>'
+    )
+
+
+def write_index(out_dir, profit_loss_summary, summaries):
+    links = ''.join(
+        f'<li><a href="{html.escape(row["报告"])}">{html.escape(str(row["名称"]))}</a></li>'
+        for row in summaries
+    )
+    body = (
+        '<h1>亏损病种图表（正为亏损）</h1>'
+        + _figure_html(top_losses_figure(profit_loss_summary, 15))
+        + _figure_html(more_losses_figure(profit_loss_summary, 60))
+        + f'<h2>全部病种（{len(summaries)}）</h2><ul>{links}</ul>'
+    )
+    with open(os.path.join(out_dir, 'index.html'), 'w', encoding='utf-8') as f:
+        f.write(_page('病种分析报告', body))
+
+
+def generate_reports(cube, out_dir, cases=None, consumables=None, workers=None, progress=None):
+    """在进程池上并行渲染所有病种，返回 {'diseases': 数量, 'seconds': 耗时}"""
+    started = time.perf_counter()
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, 'plotly.min.js'), 'w', encoding='utf-8') as f:
+        f.write(get_plotlyjs())  # 离线也能打开报告
+
+    profit_loss_summary = cube.name_summary()
+    names = profit_loss_summary.sort_values('耗材超标值', ascending=False)['名称'].tolist()
+    workers = workers or os.cpu_count() or 1
+
+    results = {}
+    if workers <= 1:
+        _init_worker(cube, cases, consumables, out_dir)
+        for position, name in enumerate(names):
+            results[position] = render_disease(position, name)
+            if progress is not None:
+                progress(len(results), len(names), name)
+    else:
+        # 数据在每个工作进程启动时只传一次，之后只传病种名称
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(cube, cases, consumables, out_dir),
+        ) as pool:
+            futures = {pool.submit(render_disease, position, name): position for position, name in enumerate(names)}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                if progress is not None:
+                    progress(len(results), len(names), names[futures[future]])
+
+    ordered = [results[position] for position in range(len(names))]
+    summaries = [r['summary'] for r in ordered]
+    write_index(out_dir, profit_loss_summary, summaries)
+
+    with pd.ExcelWriter(os.path.join(out_dir, '汇总.xlsx')) as writer:
+        pd.DataFrame(summaries).to_excel(writer, sheet_name='病种汇总', index=False)
+        pd.concat([r['departments'] for r in ordered], ignore_index=True).to_excel(writer, sheet_name='科室明细', index=False)
+        groups = [r['groups'] for r in ordered if r['groups'] is not None]
+        if groups:
+            pd.concat(groups, ignore_index=True).to_excel(writer, sheet_name='诊疗组明细', index=False)
+
+    return {
+        'diseases': len(names),
+        'seconds': time.perf_counter() - started,
+        'render_seconds': sum(r['seconds'] for r in ordered),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='批量生成全部病种的图表和文字汇总')
+    parser.add_argument('disease', help='病种详情 xlsx')
+    parser.add_argument('--cases', help='病例详情 xlsx')
+    parser.add_argument('--consumables', nargs='*', default=[], help='耗材使用 xlsx，可多个')
+    parser.add_argument('--out', default='reports', help='输出目录（默认 reports）')
+    parser.add_argument('--workers', type=int, default=None, help='并行进程数（默认 CPU 核数）')
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    cube, cases, consumables = load_inputs(args.disease, args.cases, args.consumables, args.workers)
+    loaded = time.perf_counter() - started
+    print(f'读取输入用时 {loaded:.1f} 秒')
+
+    def report(done, total, name):
+        print(f'\r[{done}/{total}] {name}'.ljust(60), end='', flush=True)
+
+    stats = generate_reports(cube, args.out, cases, consumables, args.workers, progress=report)
+    print()
+    print(
+        f'共生成 {stats["diseases"]} 个病种报告，渲染 {stats["seconds"]:.1f} 秒'
+        f'（单进程累计 {stats["render_seconds"]:.1f} 秒），总用时 {time.perf_counter() - started:.1f} 秒，'
+        f'输出目录 {os.path.abspath(args.out)}'
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+"""生成与真实表结构一致的合成数据，用于性能测试
+
+用法：
+    python benchmarks/generate_data.py --out benchmarks/data --diseases 800 --cases 200000 --consumable-rows 2000000
+
+生成 病种详情.xlsx、病例详情.xlsx 以及若干个多工作表的 耗材_N.xlsx。
+病例的 DRG名称 对应病种的 名称，耗材的 门诊号/住院号 对应病例的 病案号，页面上的联动查询都能命中。
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+from openpyxl import Workbook
+
+
+MAX_SHEET_ROWS = 1_048_575  # xlsx 单个工作表的行数上限（不含表头）
+
+DEPARTMENTS = ['普外科', '骨科', '心内科', '呼吸内科', '消化内科', '神经内科', '泌尿外科', '妇科', '产科', '儿科',
+               '肿瘤科', '内分泌科', '肾内科', '眼科', '耳鼻喉科', '心胸外科', '神经外科', '血液科']
+GROUPS = ['一组', '二组', '三组', '四组']
+PREFIXES = ['急性', '慢性', '复发性', '原发性', '继发性', '重症', '']
+ORGANS = ['阑尾', '胆囊', '肺', '支气管', '胃', '十二指肠', '结肠', '肝', '胰腺', '肾', '膀胱', '前列腺', '甲状腺',
+          '乳腺', '冠状动脉', '脑', '脊柱', '膝关节', '髋关节', '子宫', '卵巢', '视网膜', '鼻窦', '扁桃体']
+CONDITIONS = ['炎', '结石', '肿瘤', '出血', '梗阻', '狭窄', '骨折', '囊肿', '息肉', '感染', '功能不全', '损伤']
+DIAGNOSES = ['伴并发症', '不伴并发症', '伴严重并发症', '术后', '首次治疗', '复查']
+CATEGORIES = ['低倍率', '正常倍率', '高倍率']
+SURNAMES = list('王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗')
+DOCTORS = [s + g for s in SURNAMES for g in ['医生', '主任', '主治']]
+
+FEE_COLUMNS = ['床位费', '检查费', '化验费', '治疗费', '手术费', '西药费', '材料费']
+
+
+def disease_names(n, rng):
+    """组合出 n 个不重复、接近真实写法的病种名称"""
+    names = []
+    seen = set()
+    for prefix in PREFIXES:
+        for organ in ORGANS:
+            for condition in CONDITIONS:
+                name = prefix + organ + condition
+                if name not in seen:
+                    seen.add(name)
+                    names.append(name)
+    rng.shuffle(names)
+    if n > len(names):
+        names += [f'{names[i % len(names)]}{i // len(names) + 1}型' for i in range(len(names), n)]
+    return names[:n]
+
+
+def write_xlsx(path, sheets):
+    """以只写模式流式写出 xlsx，sheets 为 [(工作表名, 表头, 行迭代器)]"""
+    wb = Workbook(write_only=True)
+    for title, header, rows in sheets:
+        ws = wb.create_sheet(title)
+        ws.append(header)
+        for row in rows:
+            ws.append(row)
+    wb.save(path)
+
+
+def _rows(columns):
+    # 列数组转成逐行的 Python 原生值，openpyxl 不接受 numpy 标量
+    return zip(*[c.tolist() for c in columns])
+
+
+def generate_diseases(n, rng):
+    """返回 (病种表的表头与行, 病种名称列表, DRG 编码列表)"""
+    names = disease_names(n, rng)
+    drgs = [f'{chr(65 + i % 26)}{chr(65 + i // 26 % 26)}{i % 100:02d}' for i in range(n)]
+
+    name_idx, dep_idx, group_idx = [], [], []
+    for i in range(n):
+        departments = rng.choice(len(DEPARTMENTS), size=rng.integers(1, 5), replace=False)
+        for d in departments:
+            for g in range(rng.integers(1, len(GROUPS) + 1)):
+                name_idx.append(i)
+                dep_idx.append(d)
+                group_idx.append(g)
+    name_idx = np.array(name_idx)
+    m = len(name_idx)
+
+    cases = rng.integers(1, 120, m)
+    reference = rng.uniform(200, 8000, m).round(2)
+    average = (reference * rng.lognormal(0, 0.35, m)).round(2)
+    total_cost = (cases * rng.uniform(0.5, 6, m)).round(2)
+    columns = [
+        np.array(names, dtype=object)[name_idx],
+        np.array(drgs, dtype=object)[name_idx],
+        np.array(DEPARTMENTS, dtype=object)[dep_idx],
+        np.array(GROUPS, dtype=object)[group_idx],
+        total_cost,
+        (total_cost * rng.uniform(0.8, 1.2, m)).round(2),
+        cases,
+        (total_cost * rng.uniform(0.6, 0.95, m)).round(2),
+        (average * cases).round(2),
+        (reference * cases).round(2),
+        reference,
+        ((average - reference) * cases).round(2),
+        rng.uniform(2, 20, m).round(1),
+    ]
+    header = ['名称', 'DRG', '科室', '诊疗组', '总费用（万元）', 'DRG费用（万元）', '总例数', '医保实际费用（万元）',
+              '合计均耗材(元)', '合计耗材横向参考(元)', '例均耗材横向参考（元）', '耗材超标值（元）', '平均住院日（天）']
+    return (header, _rows(columns)), names, drgs
+
+
+def generate_cases(n, names, drgs, rng):
+    """返回病例表的表头与行，病案号从 100000 起连续编号"""
+    # 病例数按病种呈长尾分布
+    weights = rng.pareto(1.2, len(names)) + 1
+    disease = rng.choice(len(names), size=n, p=weights / weights.sum())
+    days = np.maximum(1, rng.gamma(2.5, 3.5, n).round()).astype(np.int64)
+    fees = [(days * rng.uniform(50, 2000, n)).round(2) for _ in FEE_COLUMNS]
+    columns = [
+        np.array(drgs, dtype=object)[disease],
+        np.array(names, dtype=object)[disease],
+        np.array([SURNAMES[i % len(SURNAMES)] + f'某{i}' for i in range(n)], dtype=object),
+        np.arange(100000, 100000 + n),
+        np.array(CATEGORIES, dtype=object)[rng.integers(0, len(CATEGORIES), n)],
+        np.array(DEPARTMENTS, dtype=object)[rng.integers(0, len(DEPARTMENTS), n)],
+        days,
+        rng.normal(0, 3000, n).round(2),
+        np.array(names, dtype=object)[disease] + np.array(DIAGNOSES, dtype=object)[rng.integers(0, len(DIAGNOSES), n)],
+        np.array([f'2024-{m:02d}-{d:02d}' for m, d in zip(rng.integers(1, 13, n), rng.integers(1, 29, n))], dtype=object),
+        *fees,
+    ]
+    header = ['DRG编码', 'DRG名称', '姓名', '病案号', '分类', '出院科别', '实际住院天数', '预测盈亏', '主要诊断名称',
+              '出院时间', *FEE_COLUMNS]
+    return header, _rows(columns)
+
+
+def generate_consumable_sheet(n, n_cases, n_items, rng):
+    """返回一个耗材工作表的表头与行
+
+    约 5% 的行门诊号不是数字（按住院号匹配），约 1% 的行门诊号为空（不参与匹配）。
+    """
+    patient = 100000 + rng.integers(0, n_cases, n)
+    outpatient = patient.astype(object)
+    text = rng.random(n) < 0.05
+    outpatient[text] = np.char.add('MZ', patient[text].astype(str)).astype(object)
+    outpatient[rng.random(n) < 0.01] = None
+    item = rng.integers(0, n_items, n)
+    columns = [
+        np.array([SURNAMES[p % len(SURNAMES)] + f'某{p - 100000}' for p in patient.tolist()], dtype=object),
+        patient.astype(str).astype(object),
+        outpatient,
+        np.char.add('C', item.astype(str)).astype(object),
+        np.char.add('耗材', item.astype(str)).astype(object),
+        rng.integers(1, 10, n),
+        rng.lognormal(4, 1.2, n).round(2),
+        np.array(DOCTORS, dtype=object)[rng.integers(0, len(DOCTORS), n)],
+        np.array([f'2024-{m:02d}-{d:02d}' for m, d in zip(rng.integers(1, 13, n), rng.integers(1, 29, n))], dtype=object),
+    ]
+    header = ['姓名', '住院号', '门诊号', '项目代码', '项目名称', '数量', 'AMT_HC', '医生姓名', '费用日期']
+    return header, _rows(columns)
+
+
+def generate(out_dir, diseases=800, cases=200_000, consumable_rows=1_000_000, files=2, sheets=2, items=3000, seed=0,
+             log=print):
+    """生成全部合成数据，返回 {文件类型: 路径或路径列表}"""
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+
+    # 工作表行数超过 xlsx 上限时自动增加工作表
+    per_sheet = -(-consumable_rows // (files * sheets)) if consumable_rows else 0
+    if per_sheet > MAX_SHEET_ROWS:
+        sheets = -(-consumable_rows // (files * MAX_SHEET_ROWS))
+        per_sheet = -(-consumable_rows // (files * sheets))
+
+    started = time.perf_counter()
+    (header, rows), names, drgs = generate_diseases(diseases, rng)
+    disease_path = os.path.join(out_dir, '病种详情.xlsx')
+    write_xlsx(disease_path, [('病种详情', header, rows)])
+    log(f'病种详情.xlsx  {diseases} 个病种  {time.perf_counter() - started:.1f} 秒')
+
+    started = time.perf_counter()
+    case_path = os.path.join(out_dir, '病例详情.xlsx')
+    header, rows = generate_cases(cases, names, drgs, rng)
+    write_xlsx(case_path, [('病例详情', header, rows)])
+    log(f'病例详情.xlsx  {cases} 行  {time.perf_counter() - started:.1f} 秒')
+
+    consumable_paths = []
+    remaining = consumable_rows
+    for f in range(files if consumable_rows else 0):
+        started = time.perf_counter()
+        path = os.path.join(out_dir, f'耗材_{f + 1}.xlsx')
+        parts = []
+        for s in range(sheets):
+            n = min(per_sheet, remaining)
+            remaining -= n
+            header, rows = generate_consumable_sheet(n, cases, items, rng)
+            parts.append((f'Sheet{s + 1}', header, rows))
+        write_xlsx(path, parts)
+        consumable_paths.append(path)
+        log(f'耗材_{f + 1}.xlsx  {sheets} 个工作表  {time.perf_counter() - started:.1f} 秒')
+
+    return {'病种': disease_path, '病例': case_path, '耗材': consumable_paths}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='生成病种/病例/耗材合成数据')
+    parser.add_argument('--out', default=os.path.join(os.path.dirname(__file__), 'data'), help='输出目录')
+    parser.add_argument('--diseases', type=int, default=800, help='病种数')
+    parser.add_argument('--cases', type=int, default=200_000, help='病例行数')
+    parser.add_argument('--consumable-rows', type=int, default=1_000_000, help='耗材明细总行数')
+    parser.add_argument('--files', type=int, default=2, help='耗材文件数')
+    parser.add_argument('--sheets', type=int, default=2, help='每个耗材文件的工作表数（超过行数上限时自动增加）')
+    parser.add_argument('--items', type=int, default=3000, help='耗材项目代码数')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子，相同参数生成相同数据')
+    args = parser.parse_args(argv)
+    generate(args.out, args.diseases, args.cases, args.consumable_rows, args.files, args.sheets, args.items, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+"""页面数据处理流程的性能测试
+
+用法：
+    python benchmarks/run_benchmarks.py --scale small
+    python benchmarks/run_benchmarks.py --scale medium --compare benchmarks/results/上一次.json
+
+数据目录中没有数据时先用 generate_data.py 按规模生成。各项测试按页面上的调用路径执行：
+载入（读 Excel、写 SQLite、读回、建索引）、亏损排行、切换病种、相似病例、最近邻、耗材查询，
+以及病例 × 耗材连接汇总和耗材超标排行。
+结果写入 benchmarks/results/，用 --compare 与之前的结果对比，耗时变慢超过阈值的项会被标出。
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))  # 仓库根目录没有打包，直接导入页面用的模块
+
+from case_index import CaseIndex  # noqa: E402
+from charts import department_pie, group_pie, more_losses_figure, overuse_figure, summary_text, top_losses_figure  # noqa: E402
+from consumable_ingest import ingest_consumable_files  # noqa: E402
+from consumable_usage import ConsumableUsage  # noqa: E402
+from disease_cube import DiseaseCube  # noqa: E402
+from generate_data import generate  # noqa: E402
+from patient_index import ConsumableIndex, patient_key  # noqa: E402
+from schema import compact, select_columns_sql  # noqa: E402
+from search_index import NameSearchIndex  # noqa: E402
+from storage import connect  # noqa: E402
+
+
+# 规模预设：(病种数, 病例行数, 耗材总行数)
+SCALES = {
+    'small': (100, 10_000, 100_000),
+    'medium': (800, 200_000, 1_000_000),
+    'large': (2000, 1_000_000, 5_000_000),
+}
+RESULTS_DIR = os.path.join(HERE, 'results')
+REGRESSION_RATIO = 1.2  # 比上次慢 20% 以上视为退化
+
+
+def timed(fn, repeat=1):
+    """执行 repeat 次，返回 (最后一次的结果, 每次耗时列表)"""
+    seconds = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        seconds.append(time.perf_counter() - started)
+    return result, seconds
+
+
+def per_item(fn, items):
+    """对每个样本各执行一次，返回每次耗时列表"""
+    seconds = []
+    for item in items:
+        started = time.perf_counter()
+        fn(item)
+        seconds.append(time.perf_counter() - started)
+    return seconds
+
+
+def stats(seconds, **extra):
+    ordered = sorted(seconds)
+    result = {
+        'runs': len(ordered),
+        'total': sum(ordered),
+        'min': ordered[0] if ordered else None,
+        'median': statistics.median(ordered) if ordered else None,
+        'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] if ordered else None,
+        'max': ordered[-1] if ordered else None,
+    }
+    result.update(extra)
+    return result
+
+
+def load_disease(path, conn):
+    # 与 data_visualizer.load_disease_data / build_disease_data 相同
+    df = pd.read_excel(path)
+    df['耗材超标值（元）'] = pd.to_numeric(df['耗材超标值（元）'], errors='coerce')
+    df.to_sql('病种详情', conn, if_exists='replace', index=False)
+    df = compact(df, '病种')
+    cube = DiseaseCube(df)
+    profit_loss_summary = cube.name_summary()
+    search_index = NameSearchIndex(profit_loss_summary['名称'], profit_loss_summary['DRG'])
+    return cube, profit_loss_summary, search_index
+
+
+def load_cases(path, conn):
+    case_df = pd.read_excel(path)
+    case_df.to_sql('病例详情', conn, if_exists='replace', index=False)
+    return CaseIndex(compact(pd.read_sql(f'SELECT {select_columns_sql(conn, "病例详情", "病例")} FROM 病例详情', conn), '病例'))
+
+
+def load_consumables(paths, conn, workers):
+    ingest_consumable_files(conn, paths, workers=workers)
+    frame = pd.read_sql(f'SELECT {select_columns_sql(conn, "耗材详情", "耗材")} FROM 耗材详情 ORDER BY 患者键 IS NULL, 患者键', conn)
+    return ConsumableIndex(compact(frame, '耗材'))
+
+
+def switch_disease(cube, name):
+    # 选中一个病种后页面上重算的内容：科室饼图、第一个科室的诊疗组饼图、文字汇总
+    departments = cube.departments(name)
+    department_pie(departments)
+    if not departments.empty:
+        groups = cube.groups(name, departments['科室'].iloc[0])
+        if groups is not None and not groups.empty:
+            group_pie(groups, departments['科室'].iloc[0])
+    try:
+        summary_text(cube.totals(name))
+    except ZeroDivisionError:
+        pass
+
+
+def run(paths, samples=200, ingest_repeat=1, workers=None, seed=0, log=print):
+    """执行全部测试，返回 {测试名: 统计}"""
+    rng = np.random.default_rng(seed)
+    results = {}
+
+    with tempfile.TemporaryDirectory(prefix='drg_bench_') as tmp:
+        conn = connect(os.path.join(tmp, 'bench.db'))
+
+        (cube, profit_loss_summary, _), seconds = timed(lambda: load_disease(paths['病种'], conn), ingest_repeat)
+        results['ingest_disease'] = stats(seconds, diseases=len(profit_loss_summary))
+        log(f'载入病种  {min(seconds):.2f} 秒')
+
+        case_index, seconds = timed(lambda: load_cases(paths['病例'], conn), ingest_repeat)
+        results['ingest_cases'] = stats(seconds, rows=len(case_index.frame))
+        log(f'载入病例  {min(seconds):.2f} 秒')
+
+        consumable_index = None
+        if paths['耗材']:
+            consumable_index, seconds = timed(lambda: load_consumables(paths['耗材'], conn, workers), ingest_repeat)
+            results['ingest_consumables'] = stats(seconds, rows=len(consumable_index.frame), files=len(paths['耗材']))
+            log(f'载入耗材  {min(seconds):.2f} 秒')
+        conn.close()
+
+    def top_n():
+        summary = cube.name_summary()
+        top_losses_figure(summary, 15)
+        more_losses_figure(summary, 15)
+
+    _, seconds = timed(top_n, 5)
+    results['top_n'] = stats(seconds)
+
+    names = profit_loss_summary['名称'].tolist()
+    names = [names[i] for i in rng.choice(len(names), size=min(samples, len(names)), replace=False)]
+    results['disease_switch'] = stats(per_item(lambda name: switch_disease(cube, name), names))
+
+    positions = rng.choice(len(case_index.frame), size=min(samples, len(case_index.frame)), replace=False).tolist()
+    cases = [case_index.frame.iloc[p] for p in positions]
+    results['similar_case'] = stats(per_item(case_index.similar, cases))
+    results['nearest_case'] = stats(per_item(lambda p: case_index.nearest(p, 20), positions))
+
+    if consumable_index is not None:
+        keys = [(patient_key(case['病案号']), case['姓名']) for case in cases]
+
+        def lookup(key):
+            consumable_index.lookup(*key)
+            consumable_index.summary(*key)
+
+        results['consumable_lookup'] = stats(per_item(lookup, keys))
+
+        usage, seconds = timed(lambda: ConsumableUsage(case_index.frame, consumable_index.frame))
+        results['usage_join'] = stats(seconds, rows=len(usage.joined))
+        log(f'连接汇总  {min(seconds):.2f} 秒')
+
+        def overuse_rank(drg):
+            # 页面上切换 DRG 时重算的内容：全 DRG 排行和第一个科室的排行
+            overuse_figure(usage.top_items(drg, n=20))
+            departments = usage.departments(drg)
+            if departments:
+                usage.top_items(drg, departments[0], n=20)
+
+        drgs = usage.drgs()
+        drgs = [drgs[i] for i in rng.choice(len(drgs), size=min(samples, len(drgs)), replace=False)]
+        results['overuse_rank'] = stats(per_item(overuse_rank, drgs))
+
+    for name, result in results.items():
+        if not name.startswith('ingest_') and name != 'usage_join':
+            log(f'{name:<18} 中位 {result["median"] * 1000:8.2f} ms  p95 {result["p95"] * 1000:8.2f} ms')
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(current, previous, threshold=REGRESSION_RATIO, log=print):
+    """按中位耗时对比两次结果，返回变慢超过阈值的测试名"""
+    regressions = []
+    log(f'{"测试":<18} {"上次":>10} {"本次":>10} {"比值":>7}')
+    for name, result in current.items():
+        before = previous.get(name)
+        if not before or not before.get('median') or result.get('median') is None:
+            continue
+        ratio = result['median'] / before['median']
+        flag = '  <-- 变慢' if ratio > threshold else ''
+        log(f'{name:<18} {before["median"] * 1000:8.2f}ms {result["median"] * 1000:8.2f}ms {ratio:6.2f}x{flag}')
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='页面数据处理流程的性能测试')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small', help='数据规模预设')
+    parser.add_argument('--data', help='数据目录（默认 benchmarks/data/<规模>，没有数据时自动生成）')
+    parser.add_argument('--samples', type=int, default=200, help='查询类测试的样本数')
+    parser.add_argument('--ingest-repeat', type=int, default=1, help='载入类测试的重复次数')
+    parser.add_argument('--workers', type=int, default=None, help='耗材解析进程数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--compare', help='与之前保存的结果 JSON 对比')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_RATIO, help='判定为退化的耗时比值')
+    parser.add_argument('--no-save', action='store_true', help='不保存本次结果')
+    args = parser.parse_args(argv)
+
+    diseases, cases, consumable_rows = SCALES[args.scale]
+    data_dir = args.data or os.path.join(HERE, 'data', args.scale)
+    paths = {
+        '病种': os.path.join(data_dir, '病种详情.xlsx'),
+        '病例': os.path.join(data_dir, '病例详情.xlsx'),
+        '耗材': sorted(
+            os.path.join(data_dir, f) for f in os.listdir(data_dir) if f.startswith('耗材_') and f.endswith('.xlsx')
+        ) if os.path.isdir(data_dir) else [],
+    }
+    if not (os.path.exists(paths['病种']) and os.path.exists(paths['病例'])):
+        print(f'生成 {args.scale} 规模数据到 {data_dir}')
+        paths = generate(data_dir, diseases, cases, consumable_rows, seed=args.seed)
+
+    results = run(paths, args.samples, args.ingest_repeat, args.workers, args.seed)
+    report = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'scale': args.scale,
+        'data': {
+            name: [os.path.basename(p) for p in value] if isinstance(value, list) else os.path.basename(value)
+            for name, value in paths.items()
+        },
+        'environment': environment(),
+        'benchmarks': results,
+    }
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        commit = report['environment']['commit'] or 'nogit'
+        path = os.path.join(RESULTS_DIR, f'{time.strftime("%Y%m%d-%H%M%S")}_{args.scale}_{commit}.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'结果已保存到 {path}')
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+        if previous.get('scale') != args.scale:
+            print(f'注意：对比结果的规模为 {previous.get("scale")}，本次为 {args.scale}')
+        if compare(results, previous['benchmarks'], args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
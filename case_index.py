@@ -0,0 +1,125 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from sorted_runs import run_bounds
+
+
+GROUP_COLUMNS = ['DRG名称', '分类', '主要诊断名称']
+DAYS_COLUMN = '实际住院天数'
+BASE_FEATURES = ['实际住院天数', '预测盈亏']
+
+
+class CaseIndex:
+    """病例详情的检索索引，每次上传病例文件只构建一次
+
+    - 按 DRG名称 排序（稳定排序，保留文件内原顺序），取某个 DRG 的病例只需切片；
+    - 按 (DRG名称, 分类, 主要诊断名称) 分组并按住院天数排序，住院天数区间查询用二分；
+    - 预先把住院天数、预测盈亏和费用列转成浮点矩阵，供全 DRG 最近邻检索。
+    """
+
+    def __init__(self, case_df):
+        frame = case_df
+        drgs = frame['DRG名称']
+        n_valid = int(drgs.notna().sum())
+        # 已按 DRG名称 排好序（空值在末尾）、行号从 0 连续时直接使用，不复制；例如快照读回的数据
+        if drgs.iloc[n_valid:].notna().any() or not drgs.iloc[:n_valid].is_monotonic_increasing:
+            frame = frame.sort_values('DRG名称', kind='stable', na_position='last')
+        self.frame = frame if frame.index.equals(pd.RangeIndex(len(frame))) else frame.reset_index(drop=True)
+        n = len(self.frame)
+
+        # DRG名称 -> 连续行范围
+        drg_codes, drg_names = pd.factorize(self.frame['DRG名称'])
+        starts, stops = run_bounds(drg_codes)
+        self._drgs = {
+            drg_names[drg_codes[s]]: (s, e)
+            for s, e in zip(starts.tolist(), stops.tolist())
+            if drg_codes[s] >= 0
+        }
+
+        # (DRG名称, 分类, 主要诊断名称) 分组，组内按住院天数升序；任一键为空的病例不参与匹配
+        self.days = pd.to_numeric(self.frame[DAYS_COLUMN], errors='coerce').to_numpy(dtype=float)
+        codes = [pd.factorize(self.frame[c])[0] for c in GROUP_COLUMNS]
+        order = np.lexsort((self.days, codes[2], codes[1], codes[0]))
+        order = order[(codes[0][order] >= 0) & (codes[1][order] >= 0) & (codes[2][order] >= 0)]
+        self._group_positions = order
+        self._group_days = self.days[order]
+        starts, stops = run_bounds(*(c[order] for c in codes))
+        keys = self.frame[GROUP_COLUMNS].to_numpy()
+        self._groups = {
+            tuple(keys[order[s]]): (s, e)
+            for s, e in zip(starts.tolist(), stops.tolist())
+        }
+
+        # 最近邻特征：住院天数、预测盈亏，以及所有费用列
+        self.features = [c for c in BASE_FEATURES if c in self.frame.columns]
+        self.features += [
+            c for c in self.frame.columns
+            if '费' in str(c) and c not in self.features
+            and pd.to_numeric(self.frame[c], errors='coerce').notna().any()
+        ]
+        self._matrix = np.column_stack([
+            pd.to_numeric(self.frame[c], errors='coerce').to_numpy(dtype=float)
+            for c in self.features
+        ]) if self.features else np.empty((n, 0))
+
+    @property
+    def nbytes(self):
+        return int(self.frame.memory_usage(index=True, deep=True).sum() + self._matrix.nbytes
+                   + self.days.nbytes + self._group_positions.nbytes + self._group_days.nbytes)
+
+    def drg(self, name):
+        """某个 DRG 的全部病例，保持上传文件中的顺序"""
+        start, stop = self._drgs.get(name, (0, 0))
+        return self.frame.iloc[start:stop]
+
+    def similar(self, case, window=4):
+        """同 DRG、同分类、同主要诊断，且住院天数相差不超过 window 天的病例"""
+        key = tuple(case[c] for c in GROUP_COLUMNS)
+        if key not in self._groups:
+            return self.frame.iloc[0:0]
+        start, stop = self._groups[key]
+        days = float(pd.to_numeric(case[DAYS_COLUMN], errors='coerce'))  # 整数标量加减 window 可能溢出
+        if pd.isna(days):
+            return self.frame.iloc[0:0]
+        group_days = self._group_days[start:stop]
+        lo = np.searchsorted(group_days, days - window, side='left')
+        hi = np.searchsorted(group_days, days + window, side='right')
+        positions = np.sort(self._group_positions[start + lo:start + hi])  # 恢复文件内顺序
+        return self.frame.iloc[positions]
+
+    def nearest(self, case_position, k=20):
+        """在同一 DRG 内按标准化后的欧氏距离找最相似的 k 个病例（包含自身，排在第一位）
+
+        case_position 为病例在 self.frame 中的行号。返回结果带 '相似距离' 列。
+        """
+        name = self.frame['DRG名称'].iat[case_position]
+        start, stop = self._drgs.get(name, (case_position, case_position + 1))
+        block = self._matrix[start:stop]
+        if block.shape[1] == 0:
+            return self.frame.iloc[[case_position]].assign(相似距离=0.0)
+
+        # 在 DRG 内做 z-score 标准化，缺失值视为均值
+        with warnings.catch_warnings(), np.errstate(invalid='ignore', divide='ignore'):
+            warnings.simplefilter('ignore', RuntimeWarning)  # 整列缺失时 nanmean 会告警
+            mean = np.nanmean(block, axis=0)
+            std = np.nanstd(block, axis=0)
+            std[~(std > 0)] = 1.0
+            z = (block - mean) / std
+        z = np.nan_to_num(z, nan=0.0)
+        target = z[case_position - start]
+        distance = np.sqrt(((z - target) ** 2).sum(axis=1))
+
+        rank = distance.copy()
+        rank[case_position - start] = -1.0  # 自身固定排在第一位
+        k = min(k, len(rank))
+        nearest = np.argpartition(rank, k - 1)[:k]
+        nearest = nearest[np.lexsort((nearest, rank[nearest]))]  # 距离相同按原顺序
+        result = self.frame.iloc[start + nearest].copy()
+        result['相似距离'] = distance[nearest].round(3)
+        return result
+
+    def position(self, case):
+        """病例（self.frame 中的一行）的行号"""
+        return int(case.name)
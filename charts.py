@@ -0,0 +1,154 @@
+import numpy as np
+import plotly.express as px
+import plotly.graph_objects as go
+
+
+# 页面和批量报告共用的图表与文字构建，不依赖 Streamlit
+
+
+def top_losses_figure(profit_loss_summary, n=15):
+    # 显式确保按 '耗材超标值' 降序排序
+    top_losses_sorted = profit_loss_summary.nlargest(n, '耗材超标值').sort_values(by='耗材超标值', ascending=False)
+    return px.bar(
+        top_losses_sorted,
+        x='耗材超标值',
+        y='名称',
+        orientation='h',
+        title=f'亏损最多的前{n}位病种的耗材超标值（元）',
+        hover_data=['总例数'],
+        category_orders={'名称': top_losses_sorted['名称'].tolist()},  # 指定 y 轴顺序
+    )
+
+
+def more_losses_figure(profit_loss_summary, extra_num):
+    next_losses = profit_loss_summary.nlargest(75, '耗材超标值').tail(extra_num)  # 获取额外的盈亏病种
+    next_losses_sorted = next_losses.sort_values(by='耗材超标值', ascending=False)  # 把耗材超标降序排列
+    return px.bar(
+        next_losses_sorted,
+        x='耗材超标值',
+        y='名称',
+        orientation='h',
+        height=30 * extra_num,
+        title='亏损最多的第16-45位病种的耗材超标值（元）',
+        hover_data=['总例数'],
+        category_orders={'名称': next_losses_sorted['名称'].tolist()},
+    )
+
+
+def department_pie(disease_details):
+    """病种按科室的合计耗材饼图，disease_details 来自 DiseaseCube.departments"""
+    custom_data = np.stack((
+        disease_details['DRG'].values,
+        disease_details['耗材超标值'].values,
+        disease_details['总例数'].values
+    ), axis=-1)
+
+    fig = go.Figure(go.Pie(
+        labels=disease_details['科室'],
+        values=disease_details['合计耗材'],
+        customdata=custom_data,
+        hovertemplate=(
+            "%{percent}<br>" +
+            "科室: %{label}<br>" +
+            "总例数: %{customdata[0][2]}<br>" +
+            "DRG名称: %{customdata[0][0]}<br>" +
+            "盈亏情况: %{customdata[0][1]}<extra></extra>"
+        ),
+        marker=dict(colors=px.colors.diverging.RdYlGn),
+    ))
+    fig.update_layout(
+        title={
+            'text': f'{custom_data[0][0] if len(custom_data) else ""} 的病种详情 总例数：{round(disease_details["总例数"].sum())}',
+            'x': 0.4,
+            'y': 0.97,
+            'xanchor': 'center',
+            'yanchor': 'top',
+        },
+        uniformtext_minsize=15,  # 文本信息最小值
+        uniformtext_mode='hide',  # 3种模式：[False, 'hide', 'show']
+    )
+    fig.update_traces(
+        textposition='inside',
+        textinfo='percent+label',
+    )
+    return fig
+
+
+def group_pie(group_details, department):
+    """某科室按诊疗组的合计耗材饼图，group_details 来自 DiseaseCube.groups"""
+    depart_custom_data = np.stack((
+        group_details['DRG'].values,
+        group_details['耗材超标值'].values,
+        group_details['总例数'].values
+    ), axis=-1)
+
+    fig = go.Figure(go.Pie(
+        labels=group_details['诊疗组'],
+        values=group_details['合计耗材'],
+        customdata=depart_custom_data,
+        hovertemplate=(
+            "诊疗组: %{label}<br>" +
+            "总例数: %{customdata[0][2]}<br>" +
+            "DRG:%{customdata[0][0]}<br>" +
+            "盈亏情况：%{customdata[0][1]}<br>" +
+            "<extra></extra>"
+        ),
+        marker=dict(colors=px.colors.sequential.Viridis),  # 使用颜色方案
+    ))
+    fig.update_layout(
+        title={
+            'text': f'{department} 的诊疗组详情',
+            'x': 0.5,
+            'y': 0.94,
+            'xanchor': 'center',
+            'yanchor': 'top'
+        },
+        uniformtext_minsize=15,  # 文本信息最小值
+        uniformtext_mode='hide',  # 3种模式：[False, 'hide', 'show']
+        transition_duration=500,  # 保持动画过渡
+    )
+    fig.update_traces(
+        textposition='inside',
+        textinfo='percent+label',
+    )
+    return fig
+
+
+def overuse_figure(top_items, by='超标金额', title='耗材项目排行'):
+    """耗材项目横向条形图，top_items 来自 ConsumableUsage.top_items"""
+    labels = top_items['项目代码'].astype(str) + ' ' + top_items['项目名称'].fillna('').astype(str)
+    frame = top_items.assign(项目=labels)
+    return px.bar(
+        frame,
+        x=by,
+        y='项目',
+        orientation='h',
+        height=max(400, 30 * len(frame)),
+        title=f'{title}（按{by}）',
+        hover_data=['使用病例数', '数量', '金额', '例均金额'],
+        category_orders={'项目': frame['项目'].tolist()},  # 保持排行顺序
+    )
+
+
+def summary_text(totals):
+    """'病种数据的文字显示' 的两行文字，totals 来自 DiseaseCube.totals"""
+    cost = np.stack((
+        totals['总费用（万元）'],
+        totals['DRG费用（万元）'],
+        totals['总例数'],
+        totals['医保实际费用（万元）'],
+        totals['合计均耗材(元)'],
+        totals['合计耗材横向参考(元)'],
+        totals['例均耗材横向参考（元）'],
+        totals['耗材超标值（元）'],
+    ), axis=-1)
+
+    # 每个诊疗组的 (总例数 * 平均住院天数) 总和，已在 cube 中预先算好
+    total_sum = totals.get('住院日乘积', np.nan)
+    average_days = total_sum / cost[2]
+    return [
+        f'平均住院日{round(average_days,2)}天，总费用{round(cost[0],2)}万元，DRG费用{round(cost[1],2)}万元,\
+                医保实际费用{round(cost[3],2)}万元，支付率{round(cost[1]/cost[3]*100,2)}%',
+        f'总例数{cost[2]}例，例均耗材{round(cost[4]/cost[2],2)}元，例均耗材横向参考{round(cost[6],2)}，耗材超标比{round(cost[4]/cost[5],2)},' +
+        f'即每例亏损{round(cost[4]/cost[2]-cost[6],2)},总亏损{int(cost[7]//10000)}万{round(cost[7]%10000,2)}元',
+    ]
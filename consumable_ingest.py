@@ -0,0 +1,289 @@
+import datetime
+import os
+import sqlite3
+import tempfile
+import uuid
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+from openpyxl import load_workbook
+
+from patient_index import INPATIENT_KEY, KEY_COLUMN, consumable_row_keys
+
+
+TABLE = '耗材详情'
+FILES_TABLE = '耗材文件'  # 已入库的文件，按内容哈希记录
+FILE_COLUMN = '文件哈希'  # 每行来自哪个文件，移除文件时按它删除
+CHUNK_ROWS = 20000  # 每批写入的行数，决定单个进程的内存峰值
+
+_SHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+
+def quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def list_sheets(path):
+    """直接读取 xl/workbook.xml 获取工作表名，不加载共享字符串"""
+    with zipfile.ZipFile(path) as zf:
+        root = ET.fromstring(zf.read('xl/workbook.xml'))
+    return [sheet.get('name') for sheet in root.iter(_SHEET_NS + 'sheet')]
+
+
+def _cell(value):
+    # 日期与 pandas.to_sql 的存储格式保持一致
+    if isinstance(value, datetime.datetime):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+def dedupe_columns(columns):
+    """重复的列名按 pandas.read_excel 的方式改名：备注、备注.1、备注.2 ...，跳过表头里已有的名字"""
+    columns = list(columns)
+    counts = {}
+    for i, column in enumerate(columns):
+        base = column
+        count = counts.get(column, 0)
+        while count > 0:
+            counts[base] = count + 1
+            column = f'{base}.{count}'
+            count = count + 1 if column in columns else counts.get(column, 0)
+        columns[i] = column
+        counts[column] = count + 1
+    return columns
+
+
+def iter_sheet_chunks(path, sheet, chunk_rows=CHUNK_ROWS):
+    """以只读模式流式读取工作表，先返回表头，再逐批返回数据行"""
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb[sheet]
+        # 有些导出文件的 <dimension> 写的是 A1，不重置会只读到第一个单元格（pandas 同样这样处理）
+        ws.reset_dimensions()
+        rows = ws.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        # 去掉末尾没有表头的空列，空表头按 pandas 的方式命名
+        width = len(header)
+        while width and header[width - 1] is None:
+            width -= 1
+        yield dedupe_columns([h if h is not None else f'Unnamed: {i}' for i, h in enumerate(header[:width])])
+
+        chunk = []
+        for row in rows:
+            row = tuple(_cell(v) for v in row[:width])
+            if all(v is None for v in row):
+                continue
+            if len(row) < width:
+                row += (None,) * (width - len(row))
+            chunk.append(row)
+            if len(chunk) >= chunk_rows:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        wb.close()
+
+
+def stage_sheet(path, sheet, stage_dir, chunk_rows=CHUNK_ROWS):
+    """在工作进程中解析一个工作表，写入独立的暂存库，返回 (暂存库路径, 列名, 行数)"""
+    stage_path = os.path.join(stage_dir, f'{uuid.uuid4().hex}.db')
+    chunks = iter_sheet_chunks(path, sheet, chunk_rows)
+    columns = next(chunks, None)
+    if not columns:
+        return None, [], 0
+
+    # 入库时就算好规范化的患者键和住院键，查询时不再逐行转换门诊号、住院号
+    outpatient = columns.index('门诊号') if '门诊号' in columns else None
+    inpatient = columns.index('住院号') if '住院号' in columns else None
+    derive_key = outpatient is not None and KEY_COLUMN not in columns
+    if derive_key:
+        columns = columns + [KEY_COLUMN, INPATIENT_KEY]
+
+    stage = sqlite3.connect(stage_path)
+    try:
+        stage.execute('PRAGMA journal_mode=OFF')
+        stage.execute('PRAGMA synchronous=OFF')
+        stage.execute(f'CREATE TABLE stage ({", ".join(quote(c) for c in columns)})')
+        insert = f'INSERT INTO stage VALUES ({", ".join("?" * len(columns))})'
+        rows = 0
+        for chunk in chunks:
+            if derive_key:
+                chunk = [
+                    row + consumable_row_keys(row[outpatient], row[inpatient] if inpatient is not None else None)
+                    for row in chunk
+                ]
+            stage.executemany(insert, chunk)
+            rows += len(chunk)
+        stage.commit()
+    finally:
+        stage.close()
+    return stage_path, columns, rows
+
+
+def _table_columns(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({quote(table)})')]
+
+
+def _create_files_table(conn):
+    conn.execute(
+        f'CREATE TABLE IF NOT EXISTS {quote(FILES_TABLE)} '
+        f'({quote(FILE_COLUMN)} TEXT PRIMARY KEY, 文件名 TEXT, 行数 INTEGER, 载入时间 TEXT)'
+    )
+
+
+def _load_stages(conn, stages, table, chunk_rows, file_hash=None, file_name=None):
+    """把同一个文件的所有暂存工作表在一个事务内批量写入目标表
+
+    给出 file_hash 时每行带上文件哈希，并在同一事务内登记到文件表，入库和登记要么都成功要么都不生效。
+    """
+    rows = 0
+    with conn:
+        for stage_path, columns, _ in stages:
+            target = columns + [FILE_COLUMN] if file_hash is not None else columns
+            existing = _table_columns(conn, table)
+            if not existing:
+                conn.execute(f'CREATE TABLE {quote(table)} ({", ".join(quote(c) for c in target)})')
+            else:
+                for column in target:
+                    if column not in existing:
+                        conn.execute(f'ALTER TABLE {quote(table)} ADD COLUMN {quote(column)}')
+
+            insert = (
+                f'INSERT INTO {quote(table)} ({", ".join(quote(c) for c in target)}) '
+                f'VALUES ({", ".join("?" * len(target))})'
+            )
+            stage = sqlite3.connect(stage_path)
+            try:
+                cursor = stage.execute('SELECT * FROM stage')
+                while True:
+                    chunk = cursor.fetchmany(chunk_rows)
+                    if not chunk:
+                        break
+                    if file_hash is not None:
+                        chunk = [row + (file_hash,) for row in chunk]
+                    conn.executemany(insert, chunk)
+                    rows += len(chunk)
+            finally:
+                stage.close()
+            os.remove(stage_path)
+        if file_hash is not None:
+            _create_files_table(conn)
+            conn.execute(
+                f"INSERT OR REPLACE INTO {quote(FILES_TABLE)} VALUES (?, ?, ?, datetime('now', 'localtime'))",
+                (file_hash, file_name, rows),
+            )
+    return rows
+
+
+def ingest_consumable_files(conn, paths, table=TABLE, workers=None, chunk_rows=CHUNK_ROWS,
+                            progress=None, replace=True, hashes=None, names=None):
+    """并行解析多个耗材文件的全部工作表，每个文件一个事务写入 SQLite
+
+    paths 为本地 xlsx 路径列表；progress(path, done, total, rows) 在每个文件入库后回调。
+    hashes / names 为 {路径: 内容哈希 / 原文件名}，给出时按文件登记，之后可以用 remove_consumable_files 单独移除。
+    返回写入的总行数。
+    """
+    if replace:
+        with conn:
+            conn.execute(f'DROP TABLE IF EXISTS {quote(table)}')
+            conn.execute(f'DROP TABLE IF EXISTS {quote(FILES_TABLE)}')
+    elif hashes and FILE_COLUMN not in _table_columns(conn, table):
+        # 旧版整表载入的数据没有文件哈希，无法按文件移除，先清空
+        with conn:
+            conn.execute(f'DROP TABLE IF EXISTS {quote(table)}')
+
+    tasks = [(path, sheet) for path in paths for sheet in list_sheets(path)]
+    pending = {path: sum(1 for p, _ in tasks if p == path) for path in paths}
+    staged = {path: [] for path in paths}
+    if workers is None:
+        workers = min(len(tasks), os.cpu_count() or 1)
+
+    total_rows = 0
+    done = 0
+    with tempfile.TemporaryDirectory(prefix='耗材_') as stage_dir:
+
+        def finish(path):
+            nonlocal total_rows, done
+            # 按工作表原顺序入库，与逐表读取的结果一致
+            stages = [result for _, result in sorted(staged.pop(path))]
+            rows = _load_stages(
+                conn, stages, table, chunk_rows,
+                file_hash=hashes.get(path) if hashes else None,
+                file_name=names.get(path, os.path.basename(path)) if names else os.path.basename(path),
+            )
+            total_rows += rows
+            done += 1
+            if progress is not None:
+                progress(path, done, len(paths), rows)
+
+        # 没有工作表的文件直接计为完成
+        for path in [p for p, n in pending.items() if n == 0]:
+            finish(path)
+
+        if workers <= 1:
+            for order, (path, sheet) in enumerate(tasks):
+                result = stage_sheet(path, sheet, stage_dir, chunk_rows)
+                if result[0] is not None:
+                    staged[path].append((order, result))
+                pending[path] -= 1
+                if pending[path] == 0:
+                    finish(path)
+        else:
+            # spawn 方式启动，避免在 Streamlit 的多线程进程里 fork
+            with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn')) as pool:
+                futures = {
+                    pool.submit(stage_sheet, path, sheet, stage_dir, chunk_rows): (order, path)
+                    for order, (path, sheet) in enumerate(tasks)
+                }
+                for future in as_completed(futures):
+                    order, path = futures[future]
+                    result = future.result()
+                    if result[0] is not None:
+                        staged[path].append((order, result))
+                    pending[path] -= 1
+                    if pending[path] == 0:
+                        finish(path)
+
+    columns = _table_columns(conn, table)
+    with conn:
+        for column in (KEY_COLUMN, INPATIENT_KEY, FILE_COLUMN):
+            if column in columns:
+                conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS {quote("idx_" + table + "_" + column)} '
+                    f'ON {quote(table)} ({quote(column)})'
+                )
+    return total_rows
+
+
+def ingested_files(conn):
+    """已入库的耗材文件：{内容哈希: (文件名, 行数)}，按载入顺序"""
+    if not _table_columns(conn, FILES_TABLE):
+        return {}
+    rows = conn.execute(
+        f'SELECT {quote(FILE_COLUMN)}, 文件名, 行数 FROM {quote(FILES_TABLE)} ORDER BY rowid'
+    ).fetchall()
+    return {digest: (name, count) for digest, name, count in rows}
+
+
+def remove_consumable_files(conn, digests, table=TABLE):
+    """按内容哈希删除文件的全部行及其登记，返回删除的行数；删除走文件哈希索引，与其余文件的数据量无关"""
+    removed = 0
+    if not digests:
+        return removed
+    tracked = FILE_COLUMN in _table_columns(conn, table)
+    with conn:
+        _create_files_table(conn)
+        for digest in digests:
+            if tracked:
+                removed += conn.execute(
+                    f'DELETE FROM {quote(table)} WHERE {quote(FILE_COLUMN)} = ?', (digest,)
+                ).rowcount
+            conn.execute(f'DELETE FROM {quote(FILES_TABLE)} WHERE {quote(FILE_COLUMN)} = ?', (digest,))
+    return removed
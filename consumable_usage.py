@@ -0,0 +1,229 @@
+import numpy as np
+import pandas as pd
+
+from consumable_ingest import FILE_COLUMN
+from patient_index import INPATIENT_KEY, KEY_COLUMN, patient_key
+from sorted_runs import run_offsets
+
+
+ITEM = '项目代码'
+DRG = 'DRG名称'
+DEPARTMENT = '出院科别'
+DOCTOR = '医生姓名'
+NAME = '姓名'
+
+
+def case_keys(case_frame):
+    """病例的患者键及其 DRG、科室；同一患者键有多条病例时只取第一条，耗材只能归到一个病例"""
+    cases = pd.DataFrame({
+        KEY_COLUMN: case_frame['病案号'].map(patient_key),
+        NAME: case_frame[NAME].astype(object) if NAME in case_frame.columns else None,
+        DRG: case_frame[DRG].astype(object),
+        DEPARTMENT: case_frame[DEPARTMENT].astype(object) if DEPARTMENT in case_frame.columns else None,
+    })
+    return cases.dropna(subset=[KEY_COLUMN, DRG]).drop_duplicates(KEY_COLUMN).reset_index(drop=True)
+
+
+def join_consumables(cases, consumable_frame):
+    """耗材明细连接病例，再按 (文件, 患者, 医生, 项目) 预先求和
+
+    匹配规则与 ConsumableIndex.lookup 相同：门诊号（患者键）等于病案号，或者住院键等于病案号且姓名相同；
+    两种都能匹配时算在门诊号对应的病例上，每行只计一次。
+    """
+    columns = [KEY_COLUMN, INPATIENT_KEY, NAME, ITEM, DOCTOR, '数量', 'AMT_HC']
+    if FILE_COLUMN in consumable_frame.columns:
+        columns.append(FILE_COLUMN)
+    rows = consumable_frame[[c for c in columns if c in consumable_frame.columns]].copy()
+    if DOCTOR not in rows.columns:
+        rows[DOCTOR] = None
+    if FILE_COLUMN not in rows.columns:
+        rows[FILE_COLUMN] = ''  # 没有按文件登记的数据视为同一个文件
+    for column in (KEY_COLUMN, INPATIENT_KEY, NAME, ITEM, DOCTOR, FILE_COLUMN):
+        if column in rows.columns:
+            rows[column] = rows[column].astype(object)
+    rows['数量'] = pd.to_numeric(rows['数量'], errors='coerce').astype(float)
+    rows['AMT_HC'] = pd.to_numeric(rows['AMT_HC'], errors='coerce').astype(float)
+
+    joined = rows.merge(cases.drop(columns=NAME), on=KEY_COLUMN, how='inner')
+    if INPATIENT_KEY in rows.columns and NAME in rows.columns:
+        rest = rows[~rows[KEY_COLUMN].isin(cases[KEY_COLUMN])].drop(columns=KEY_COLUMN)
+        by_inpatient = rest.merge(
+            cases.rename(columns={KEY_COLUMN: INPATIENT_KEY}), on=[INPATIENT_KEY, NAME], how='inner',
+        ).rename(columns={INPATIENT_KEY: KEY_COLUMN})
+        joined = pd.concat([joined, by_inpatient], ignore_index=True)
+    return (
+        joined.groupby([FILE_COLUMN, KEY_COLUMN, DRG, DEPARTMENT, DOCTOR, ITEM], sort=False, dropna=False)
+        .agg(数量=('数量', 'sum'), 金额=('AMT_HC', 'sum'))
+        .reset_index()
+    )
+
+
+class ConsumableUsage:
+    """病例 × 耗材连接后的耗材使用汇总，用于找出各 DRG / 科室超标的耗材项目
+
+    连接结果按 (文件, 患者, 医生, 项目) 预先求和后常驻内存；新增或移除耗材文件时只连接新文件的行、
+    去掉被移除文件的行，再重新汇总。汇总表：
+
+    - 按 (DRG, 项目)：参考例均金额 = 该 DRG 全部病例的例均金额；
+    - 按 (DRG, 科室, 项目) 与 (DRG, 医生, 项目)：超标金额 = 实际金额 - 病例数 × DRG 参考例均金额；
+    - 按 (科室, 项目)：实际金额减去按科室各 DRG 病例数调整病种构成后的期望金额。
+
+    科室、医生的汇总表只保留实际用到的项目，行数与连接结果同一量级。
+    """
+
+    def __init__(self, case_frame, consumable_frame, cases=None, joined=None, items=None, files=None):
+        self.cases = case_keys(case_frame) if cases is None else cases
+        self.joined = join_consumables(self.cases, consumable_frame) if joined is None else joined
+        if files is None:
+            files = set(consumable_frame[FILE_COLUMN].unique()) if FILE_COLUMN in consumable_frame.columns else {''}
+        self.files = files  # 已连接的耗材文件哈希
+        if items is None:
+            items = consumable_frame.groupby(ITEM, observed=True)['项目名称'].first() \
+                if '项目名称' in consumable_frame.columns else pd.Series(dtype=object)
+            items = pd.Series(items.to_numpy(dtype=object), index=items.index.astype(object))
+        self.items = items  # 项目代码 -> 项目名称
+        self._build()
+
+    @property
+    def nbytes(self):
+        frames = [self.cases, self.joined, self.by_drg, self.by_department, self.by_doctor, self.department_totals]
+        return int(sum(f.memory_usage(index=True, deep=True).sum() for f in frames))
+
+    def update(self, consumable_frame, added, removed):
+        """新增 / 移除耗材文件后的使用汇总；只连接 added 文件的行，病例不变"""
+        joined = self.joined
+        if removed:
+            joined = joined[~joined[FILE_COLUMN].isin(removed)]
+        items = self.items
+        if added:
+            rows = consumable_frame[consumable_frame[FILE_COLUMN].isin(added)]
+            joined = pd.concat([joined, join_consumables(self.cases, rows)], ignore_index=True)
+            new_items = rows.groupby(ITEM, observed=True)['项目名称'].first()
+            new_items = pd.Series(new_items.to_numpy(dtype=object), index=new_items.index.astype(object))
+            items = pd.concat([items, new_items[~new_items.index.isin(items.index)]])
+        files = (self.files - set(removed)) | set(added)
+        return ConsumableUsage(None, None, cases=self.cases, joined=joined, items=items, files=files)
+
+    def _build(self):
+        joined = self.joined
+        agg = dict(数量=('数量', 'sum'), 金额=('金额', 'sum'), 使用病例数=(KEY_COLUMN, 'nunique'))
+
+        # DRG 的病例数取自病例表（包括没有耗材记录的病例）
+        drg_cases = self.cases.groupby(DRG).size().rename('病例数')
+        by_drg = joined.groupby([DRG, ITEM], dropna=False).agg(**agg).reset_index()
+        by_drg = by_drg.join(drg_cases, on=DRG)
+        by_drg['例均金额'] = by_drg['金额'] / by_drg['病例数']
+        reference = by_drg.set_index([DRG, ITEM])['例均金额'].rename('参考例均金额')
+
+        # 科室、医生只保留实际用到的项目；没用到的项目超标金额为负，不影响超标排行
+        department_cases = self.cases.groupby([DRG, DEPARTMENT], dropna=False).size().rename('病例数')
+        by_department = self._excess(
+            joined.groupby([DRG, DEPARTMENT, ITEM], dropna=False).agg(**agg).reset_index(),
+            department_cases, reference, DEPARTMENT,
+        )
+
+        # 医生：病例数为该医生在该 DRG 有耗材记录的病例数
+        doctor_cases = joined.groupby([DRG, DOCTOR], dropna=False)[KEY_COLUMN].nunique().rename('病例数')
+        by_doctor = self._excess(
+            joined.groupby([DRG, DOCTOR, ITEM], dropna=False).agg(**agg).reset_index(),
+            doctor_cases, reference, DOCTOR,
+        )
+
+        # 全 DRG 的超标金额：各科室超出 DRG 参考的部分之和
+        positive = by_department[by_department['超标金额'] > 0].groupby([DRG, ITEM], dropna=False)['超标金额'].sum()
+        by_drg = by_drg.join(positive, on=[DRG, ITEM]).fillna({'超标金额': 0.0})
+
+        # 科室跨 DRG 汇总；每个患者只属于一个 DRG，使用病例数可以直接相加
+        department_totals = by_department.groupby([DEPARTMENT, ITEM], dropna=False)[
+            ['数量', '金额', '使用病例数']
+        ].sum().reset_index()
+        cases_per_department = self.cases.groupby(DEPARTMENT, dropna=False).size().rename('病例数')
+        department_totals = department_totals.join(cases_per_department, on=DEPARTMENT)
+        department_totals['期望金额'] = self._case_mix_expected(department_totals, department_cases, reference)
+        department_totals['例均金额'] = department_totals['金额'] / department_totals['病例数']
+        department_totals['参考例均金额'] = department_totals['期望金额'] / department_totals['病例数']
+        department_totals['超标金额'] = (department_totals['金额'] - department_totals['期望金额']).round(2)
+
+        self.by_drg = by_drg.sort_values([DRG, ITEM], kind='stable').reset_index(drop=True)
+        self.by_department = by_department.sort_values([DRG, DEPARTMENT], kind='stable').reset_index(drop=True)
+        self.by_doctor = by_doctor.sort_values([DRG, ITEM], kind='stable').reset_index(drop=True)
+        self.department_totals = department_totals.sort_values([DEPARTMENT, ITEM], kind='stable').reset_index(drop=True)
+        self._drg_offsets = run_offsets(self.by_drg[DRG].to_numpy())
+        self._department_offsets = run_offsets(self.by_department[DRG].to_numpy())
+        self._doctor_offsets = run_offsets(self.by_doctor[DRG].to_numpy())
+        self._department_total_offsets = run_offsets(self.department_totals[DEPARTMENT].to_numpy())
+
+    @staticmethod
+    def _excess(actual, group_cases, reference, level):
+        # 超标金额 = 实际金额 - 组内病例数 × DRG 参考例均金额
+        result = actual.join(group_cases, on=[DRG, level]).join(reference, on=[DRG, ITEM])
+        result['例均金额'] = result['金额'] / result['病例数']
+        result['期望金额'] = result['病例数'] * result['参考例均金额']
+        result['超标金额'] = (result['金额'] - result['期望金额']).round(2)  # 按分取整，避免浮点误差排进超标
+        return result
+
+    @staticmethod
+    def _case_mix_expected(department_totals, department_cases, reference):
+        """科室各项目的期望金额 = Σ_DRG 科室在该 DRG 的病例数 × DRG 参考例均金额
+
+        科室在某个 DRG 里没用过的项目也要计入期望，按 (科室 × DRG) 病例数矩阵乘 (DRG × 项目) 参考值计算，
+        参考值按稀疏的 (DRG, 项目) 行用 bincount 累加，不展开成稠密的 DRG × 项目矩阵。
+        """
+        drgs = pd.Index(reference.index.get_level_values(DRG).unique())
+        items = pd.Index(department_totals[ITEM].unique())
+        departments = pd.Index(department_totals[DEPARTMENT].unique())
+
+        counts = department_cases.reset_index()
+        rows = departments.get_indexer(counts[DEPARTMENT])
+        columns = drgs.get_indexer(counts[DRG])
+        keep = (rows >= 0) & (columns >= 0)
+        matrix = np.zeros((len(departments), len(drgs)))
+        np.add.at(matrix, (rows[keep], columns[keep]), counts['病例数'].to_numpy()[keep])
+
+        ref_drg = drgs.get_indexer(reference.index.get_level_values(DRG))
+        ref_item = items.get_indexer(reference.index.get_level_values(ITEM))
+        used = ref_item >= 0
+        ref_drg, ref_item, ref_value = ref_drg[used], ref_item[used], reference.to_numpy()[used]
+
+        expected = np.empty((len(departments), len(items)))
+        for row in range(len(departments)):
+            expected[row] = np.bincount(ref_item, weights=matrix[row, ref_drg] * ref_value, minlength=len(items))
+        return expected[departments.get_indexer(department_totals[DEPARTMENT]), items.get_indexer(department_totals[ITEM])]
+
+    def drgs(self):
+        return sorted(self._drg_offsets, key=str)
+
+    def departments(self, drg=None):
+        if drg is None:
+            return sorted(self._department_total_offsets, key=str)
+        start, stop = self._department_offsets.get(drg, (0, 0))
+        return sorted(self.by_department[DEPARTMENT].iloc[start:stop].dropna().unique(), key=str)
+
+    def _slice(self, drg=None, department=None):
+        if drg is None and department is None:
+            return self.by_drg.iloc[0:0]
+        if drg is None:
+            start, stop = self._department_total_offsets.get(department, (0, 0))
+            return self.department_totals.iloc[start:stop]
+        if department is None:
+            start, stop = self._drg_offsets.get(drg, (0, 0))
+            return self.by_drg.iloc[start:stop]
+        start, stop = self._department_offsets.get(drg, (0, 0))
+        rows = self.by_department.iloc[start:stop]
+        return rows[rows[DEPARTMENT] == department]
+
+    def top_items(self, drg=None, department=None, n=20, by='超标金额'):
+        """某个 DRG、某个科室，或某个 DRG 内某个科室的耗材项目，按 by 倒序取前 n 项"""
+        rows = self._slice(drg, department)
+        top = rows.nlargest(n, by) if n else rows.sort_values(by, ascending=False)
+        top = top.assign(项目名称=top[ITEM].map(self.items))
+        columns = [ITEM, '项目名称', '使用病例数', '数量', '金额', '例均金额', '参考例均金额', '超标金额']
+        return top[[c for c in columns if c in top.columns]].reset_index(drop=True)
+
+    def doctors(self, drg, item):
+        """某个 DRG 内某个耗材项目按医生的使用情况，按超标金额倒序"""
+        start, stop = self._doctor_offsets.get(drg, (0, 0))
+        rows = self.by_doctor.iloc[start:stop]
+        rows = rows[(rows[ITEM] == item) & (rows['使用病例数'] > 0)]
+        return rows[[DOCTOR, '使用病例数', '数量', '金额', '例均金额', '超标金额']] \
+            .sort_values('超标金额', ascending=False).reset_index(drop=True)
@@ -1,41 +1,355 @@
+import functools
 import pandas as pd
 import streamlit as st
-import plotly.graph_objects as go
-import plotly.express as px
-import numpy as np
-import sqlite3  # 导入 SQLite 库
+import os
+import tempfile
+import time
+import uuid
+from io import BytesIO
 
+from case_index import CaseIndex
+from charts import department_pie, group_pie, more_losses_figure, overuse_figure, summary_text, top_losses_figure
+from consumable_ingest import ingest_consumable_files, ingested_files, remove_consumable_files
+from consumable_usage import ConsumableUsage
+from disease_cube import DiseaseCube
+from ingest_cache import IngestCache, content_hash
+from jobs import JobManager
+from memory_budget import SessionFrameStore
+from patient_index import ConsumableIndex, patient_key
+from profiling import ENABLED as PROFILE_ENABLED, Profiler, append_log
+from schema import compact, is_compact, select_columns_sql
+from search_index import NameSearchIndex
+from snapshots import SnapshotStore
+from storage import SESSION_TTL, SessionStorage
+from tables import paged_dataframe
+
+
+@st.cache_resource
+def get_storage():
+    # 每个会话单独一个 SQLite 库（WAL + 连接池），多人同时使用互不覆盖、互不阻塞
+    return SessionStorage()
+
+
+# 当前会话的存储命名空间
+session_id = st.session_state.setdefault('storage_session', uuid.uuid4().hex)
+storage = get_storage()
+
+# 本次重跑的阶段计时：设置环境变量 DRG_PROFILE=1 或在网址后加 ?profile=1 开启
+profiler = Profiler(enabled=PROFILE_ENABLED or st.query_params.get('profile') == '1')
+
+
+@st.cache_resource
+def get_frame_store():
+    # 所有会话的病例/耗材数据共用一个内存预算，超出时回收最久未访问会话的数据
+    return SessionFrameStore(max_bytes=int(os.environ.get('DRG_MEMORY_BUDGET_MB', 4096)) * 1024 ** 2)
+
+
+frame_store = get_frame_store()
+
+
+@st.cache_resource
+def get_snapshots():
+    # 按期间和版本保存的列式快照，重新打开时内存映射读取
+    return SnapshotStore()
+
+
+@st.cache_resource
+def get_ingest_cache():
+    # 进程内共享的解析缓存，同一份文件只解析、入库一次
+    return IngestCache(max_bytes=1024 ** 3, max_entries=8)
+
+
+# 图表按 (数据键, 选择) 缓存：数据键是病种文件的内容哈希或快照键，输入不变时直接复用已构建的图表
+# 以 _ 开头的参数不参与缓存键，只在未命中时用来构建
+
+@st.cache_resource(max_entries=256, show_spinner=False)
+def cached_top_losses(data_key, n, _profit_loss_summary):
+    return top_losses_figure(_profit_loss_summary, n)
+
+
+@st.cache_resource(max_entries=256, show_spinner=False)
+def cached_more_losses(data_key, extra_num, _profit_loss_summary):
+    return more_losses_figure(_profit_loss_summary, extra_num)
+
+
+@st.cache_resource(max_entries=256, show_spinner=False)
+def cached_department_pie(data_key, disease, _disease_details):
+    return department_pie(_disease_details)
+
+
+@st.cache_resource(max_entries=256, show_spinner=False)
+def cached_group_pie(data_key, disease, department, _group_details):
+    return group_pie(_group_details, department)
+
+
+@st.cache_resource
+def get_jobs():
+    # 后台载入线程池：解析上传文件时页面继续使用之前的数据，完成后一次性换入
+    return JobManager()
+
+
+jobs = get_jobs()
+frame_store.touch(session_id)
+expired = storage.touch(session_id)  # 会话库与内存中的数据同时保留，之后增量载入耗材仍能用库里的文件登记
+expired += frame_store.drop_idle(SESSION_TTL)  # 与会话数据库同样的过期时间
+for expired_session in set(expired):
+    jobs.drop_session(expired_session)  # 关闭页面的会话不会再来取结果，丢弃它的任务
+
+
+def uploaded_digest(uploaded):
+    # 同一次上传的 file_id 不变，记住它的内容哈希，避免每次重跑都重新计算
+    digests = st.session_state.setdefault('file_digests', {})
+    file_id = getattr(uploaded, 'file_id', None) or uploaded.name
+    if file_id not in digests:
+        digests[file_id] = content_hash(uploaded.getvalue())
+    return digests[file_id]
+
+
+def load_disease_data(job, uploaded, digest, sid, cache):
+    """后台任务：解析病种文件、写库并建立汇总，结果按内容哈希放入共享缓存"""
+    def load():
+        with job.span('病种.read_excel'):
+            df = pd.read_excel(BytesIO(uploaded.getvalue()))
+        df['耗材超标值（元）'] = pd.to_numeric(df['耗材超标值（元）'], errors='coerce')  # 保留之前的类型转换
+        job.update(0.5, rows=len(df), message='写入数据库')
+
+        # 将数据写入数据库
+        with storage.connection(sid) as conn, job.span('病种.to_sql'):
+            df.to_sql('病种详情', conn, if_exists='replace', index=False)  # 将 DataFrame 存储到数据库
+        job.update(0.7, message='建立汇总和索引')
+        return build_disease_data(df, job)
+
+    return cache.get_or_load(digest, load)
+
+
+def build_disease_data(df, timer=None):
+    with (timer or profiler).span('病种.汇总与索引'):
+        df = compact(df, '病种')  # 只保留用到的列，文本列转 category
+        # 按 (名称, 科室, 诊疗组) 预先汇总，排行、饼图和文字显示都从 cube 取数
+        cube = DiseaseCube(df)
+        profit_loss_summary = cube.name_summary()
+        # 病种名称和 DRG 编码的检索索引，搜索框每次输入只查索引
+        search_index = NameSearchIndex(profit_loss_summary['名称'], profit_loss_summary['DRG'])
+    return {'df': df, 'cube': cube, 'profit_loss_summary': profit_loss_summary, 'search_index': search_index}
+
+
+def load_case_data(job, uploaded, sid):
+    """后台任务：解析病例文件、写库，读回用到的列并建立检索索引"""
+    with job.span('病例.read_excel'):
+        case_df = pd.read_excel(BytesIO(uploaded.getvalue()))  # 读取文件，如之前一样
+    job.update(0.4, rows=len(case_df), message='写入数据库')
+
+    with storage.connection(sid) as conn:
+        # 写入数据库（新添加）
+        with job.span('病例.to_sql'):
+            case_df.to_sql('病例详情', conn, if_exists='replace', index=False)  # 写入一个新表 '病例详情'
+        job.update(0.6, message='读回用到的列')
+
+        # 现在从数据库读取用到的列并存储
+        with job.span('病例.read_sql'):
+            case_df = pd.read_sql(f'SELECT {select_columns_sql(conn, "病例详情", "病例")} FROM 病例详情', conn)
+    job.update(0.8, message='建立检索索引')
+    return build_case_index(case_df, job)
+
+
+def load_consumable_data(job, uploads, base_frame, base_files, sid):
+    """后台任务：按内容哈希同步耗材文件
+
+    只解析新增的文件，只删除被移除文件的行，相同内容重复上传不做任何事。
+    base_frame 为当前内存中的数据，它正好对应库里已有的文件（base_files）时只做增量。
+    返回 {'index': 新索引（数据没有变化时为 None）, 'files', 'added', 'removed'}。
+    """
+    with storage.connection(sid) as conn:
+        known = ingested_files(conn)
+        added = [digest for digest in uploads if digest not in known]
+        removed = [digest for digest in known if digest not in uploads]
+        with job.span('耗材.移除文件'):
+            remove_consumable_files(conn, removed)
+
+        if added:
+            # 流式、多进程解析新增文件的所有工作表，每个文件一个事务写入数据库
+            with tempfile.TemporaryDirectory(prefix='耗材上传_') as upload_dir:
+                paths = {}
+                for i, digest in enumerate(added):
+                    path = os.path.join(upload_dir, f'{i}.xlsx')
+                    with open(path, 'wb') as f:
+                        f.write(uploads[digest].getbuffer())
+                    paths[path] = digest
+                loaded_rows = 0
+
+                def report(path, done, total, rows):
+                    nonlocal loaded_rows
+                    loaded_rows += rows
+                    job.update(0.9 * done / total, rows=loaded_rows,
+                               message=f'已载入 {uploads[paths[path]].name}（{rows} 行），{done}/{total} 个文件')
+
+                with job.span('耗材.解析入库'):
+                    ingest_consumable_files(
+                        conn, list(paths), progress=report, replace=False,
+                        hashes=paths, names={path: uploads[digest].name for path, digest in paths.items()},
+                    )
+
+        index = None
+        incremental = base_frame is not None and set(base_files) == set(known)
+        if incremental and (added or removed):
+            # 内存中的数据只去掉移除文件的行、补上新增文件的行
+            frame = base_frame
+            if removed:
+                frame = frame[~frame['文件哈希'].isin(removed)]
+            if added:
+                with job.span('耗材.read_sql'):
+                    new_rows = pd.read_sql(
+                        f'SELECT {select_columns_sql(conn, "耗材详情", "耗材")} FROM 耗材详情 '
+                        f'WHERE 文件哈希 IN ({", ".join("?" * len(added))}) ORDER BY 患者键 IS NULL, 患者键',
+                        conn, params=added,
+                    )
+                frame = pd.concat([frame, new_rows], ignore_index=True)
+            index = build_consumable_index(frame, job)
+        elif not incremental:
+            # 现在从数据库读取用到的列
+            # 按患者键顺序读取（空键排在最后，与 ConsumableIndex 的顺序一致，无需再排序），再建立内存中的分组偏移索引
+            with job.span('耗材.read_sql'):
+                frame = pd.read_sql(f'SELECT {select_columns_sql(conn, "耗材详情", "耗材")} FROM 耗材详情 ORDER BY 患者键 IS NULL, 患者键', conn)
+            job.update(0.95, rows=max(job.rows, len(frame)), message='建立检索索引')
+            index = build_consumable_index(frame, job)
+    return {'index': index, 'files': tuple(uploads), 'added': len(added), 'removed': len(removed)}
+
+
+def finish_job(job):
+    # 结果已换入：从任务表移除；开启性能分析时把后台任务各阶段耗时写入日志
+    jobs.pop(session_id, job.name)
+    job.result = None  # 数据已放入内存预算，任务对象不再引用它
+    if profiler.enabled:
+        append_log(job.profiler.record(session_id, job=job.name, rows=job.rows, seconds=round(job.elapsed, 2)))
+
+
+def fail_job(job, label):
+    # 显示错误后移除失败的任务，之后重跑会重新提交同一份输入（例如数据库暂时被锁）
+    st.error(f'{label}：{job.error}')
+    jobs.pop(session_id, job.name)
+
+
+def build_case_index(case_df, timer=None, compacted=False):
+    # compacted：快照里保存的已是精简后的数据，直接使用内存映射的列，不再复制
+    with (timer or profiler).span('病例.建立索引'):
+        if not (compacted and is_compact(case_df, '病例')):
+            case_df = compact(case_df, '病例')
+        return CaseIndex(case_df)  # 按 DRG / 分类 / 诊断建立检索索引
+
+
+def install_cases(index, source):
+    # 病例检索索引（含数据本身）放入共享的内存预算，session state 只记录来源：'upload' 或 'snapshot'
+    frame_store.put(session_id, 'case_index', index)
+    st.session_state.case_source = source
+    return frame_store.get(session_id, 'case_index')
+
+
+def build_consumable_index(frame, timer=None, compacted=False):
+    # 建立按患者键的偏移索引，combined_df 即索引内排好序的数据
+    with (timer or profiler).span('耗材.建立索引'):
+        if not (compacted and is_compact(frame, '耗材')):
+            frame = compact(frame, '耗材')
+        return ConsumableIndex(frame)
+
+
+def install_consumables(index, source):
+    frame_store.put(session_id, 'consumable_index', index)
+    st.session_state.consumable_source = source
+    return frame_store.get(session_id, 'consumable_index')
+
+
+def load_usage(job, case_frame, consumable_frame, base, added, removed):
+    """后台任务：按患者键连接病例与耗材并汇总；base 为同一份病例的旧汇总时只连接新增文件的行"""
+    if base is not None:
+        job.update(0.3, message=f'增量连接（新增 {len(added)} 个、移除 {len(removed)} 个文件）')
+        with job.span('耗材分析.增量连接'):
+            usage = base.update(consumable_frame, added, removed)
+    else:
+        job.update(0.3, message='连接病例与耗材')
+        with job.span('耗材分析.连接汇总'):
+            usage = ConsumableUsage(case_frame, consumable_frame)
+    job.update(1.0, rows=len(usage.joined))
+    return usage
+
+
+def load_snapshot(period, version, datasets=('病种', '病例', '耗材')):
+    available = get_snapshots().manifest(period, version)['datasets']
+    with profiler.span('快照.载入'):
+        frames = get_snapshots().load(period, version, [name for name in ('病例', '耗材') if name in datasets])
+    if '病例' in frames:
+        install_cases(build_case_index(frames['病例'], compacted=True), 'snapshot')
+        st.session_state.case_snapshot = (period, version)
+    if '耗材' in frames:
+        install_consumables(build_consumable_index(frames['耗材'], compacted=True), 'snapshot')
+        st.session_state.consumable_snapshot = (period, version)
+    # 病种数据在侧边栏按快照键读取并缓存
+    if '病种' in datasets and '病种' in available:
+        st.session_state.snapshot_disease = (period, version)
 
-# 创建数据库连接
-conn = sqlite3.connect('病种数据.db')  # 创建或连接到 SQLite 数据库
 
 # 使用侧边栏组织上传和搜索部分
 with st.sidebar:
-    tab1, tab2, tab3 = st.tabs(["病种", "病例", "耗材"])
+    tab1, tab2, tab3, tab4 = st.tabs(["病种", "病例", "耗材", "快照"])
     
     with tab1:
         selected_disease = None
+        disease_data = None
         uploaded_file = st.file_uploader("上传病种详情文件(支持拖拽和文件选择)", type=["xlsx"])  # 支持拖拽和文件选择
         
-        if uploaded_file is not None:
-            df = pd.read_excel(uploaded_file)
-            df['耗材超标值（元）'] = pd.to_numeric(df['耗材超标值（元）'], errors='coerce')  # 保留之前的类型转换
-            
-            # 将数据写入数据库
-            df.to_sql('病种详情', conn, if_exists='replace', index=False)  # 将 DataFrame 存储到数据库
-            
-            # 从数据库读取数据
-            profit_loss_summary = pd.read_sql(
-                'SELECT 名称, SUM(耗材超标值（元）) AS 耗材超标值, SUM(总例数) AS 总例数, MAX(DRG) AS DRG FROM 病种详情 GROUP BY 名称', 
-                conn
+        # 新上传的文件优先于已加载的快照
+        if uploaded_file is not None and uploaded_digest(uploaded_file) != st.session_state.get('disease_upload_digest'):
+            st.session_state.disease_upload_digest = uploaded_digest(uploaded_file)
+            st.session_state.pop('snapshot_disease', None)
+        if uploaded_file is None:
+            jobs.pop(session_id, '病种')  # 载入中途移除了上传文件，丢弃还没取走的任务
+
+        if 'snapshot_disease' in st.session_state:
+            # 从快照内存映射读取，不再解析 Excel
+            period, version = st.session_state.snapshot_disease
+            disease_key = f'snapshot:{period}:v{version}'
+            disease_data = get_ingest_cache().get_or_load(
+                disease_key,
+                lambda: build_disease_data(get_snapshots().load(period, version, ['病种'])['病种']),
             )
-            top15_losses = profit_loss_summary.nlargest(15, '耗材超标值')
+            st.caption(f'当前病种数据来自快照 {period} v{version}')
+        elif uploaded_file is not None:
+            # 按文件内容哈希缓存，重跑时不再重复解析和写库
+            disease_key = uploaded_digest(uploaded_file)
+            disease_data = get_ingest_cache().get(disease_key)
+            if disease_data is None:
+                # 没有缓存的文件在后台解析，完成前继续显示之前的数据
+                job = jobs.submit(
+                    session_id, '病种', disease_key, load_disease_data,
+                    uploaded_file, disease_key, session_id, get_ingest_cache(),
+                )
+                if job.state == 'done':
+                    disease_data = job.result
+                    finish_job(job)
+                else:
+                    if job.state == 'failed':
+                        fail_job(job, '病种文件载入失败')
+                    disease_key = st.session_state.get('disease_active_key')
+                    disease_data = get_ingest_cache().get(disease_key) if disease_key else None
+                    if disease_data is not None:
+                        st.caption('新文件载入完成前显示之前的数据')
+            else:
+                job = jobs.get(session_id, '病种')
+                if job is not None and job.state == 'done':
+                    finish_job(job)  # 后台任务已把结果放进共享缓存
+            if disease_data is not None:
+                st.session_state.disease_active_key = disease_key
+
+        if disease_data is not None:
+            df = disease_data['df']
+            disease_cube = disease_data['cube']
+            profit_loss_summary = disease_data['profit_loss_summary']
             
             # 添加搜索框
-            search_query = st.text_input('搜索病种名称', placeholder='输入关键词搜索')
+            search_query = st.text_input('搜索病种名称', placeholder='输入名称、DRG编码或拼音首字母')
             
             if search_query:
-                filtered_names = [name for name in profit_loss_summary['名称'].tolist() if search_query.lower() in name.lower()]
+                with profiler.span('病种.搜索'):
+                    filtered_names = disease_data['search_index'].search(search_query)
                 selected_disease = st.selectbox('选择病种查看详情 (过滤后)', filtered_names)
             else:
                 selected_disease = st.selectbox('选择病种查看详情', profit_loss_summary['名称'], placeholder='搜索病种名称...')
@@ -47,25 +361,32 @@ with tab2:
     
     # 添加文件上传组件
     uploaded_case_file = st.file_uploader("上传病例详情文件(支持拖拽和文件选择)", type=["xlsx"])  # 支持拖拽和文件选择
+    case_upload_id = getattr(uploaded_case_file, 'file_id', None)
+    case_index = frame_store.get(session_id, 'case_index')
+    case_source = st.session_state.get('case_source')
+    if uploaded_case_file is None:
+        jobs.pop(session_id, '病例')  # 载入中途移除了上传文件，丢弃还没取走的任务
     
-    if 'case_df' not in st.session_state and uploaded_case_file is not None:
-        case_df = pd.read_excel(uploaded_case_file)  # 读取文件，如之前一样
-        
-        # 写入数据库（新添加）
-        case_df.to_sql('病例详情', conn, if_exists='replace', index=False)  # 写入一个新表 '病例详情'
-        
-        # 现在从数据库读取并存储到 session state
-        st.session_state.case_df = pd.read_sql('SELECT * FROM 病例详情', conn)  # 从数据库读取回来
-        
-        
-    elif 'case_df' in st.session_state and uploaded_case_file is not None:
-        # 如果已经在 session state 中，可以继续使用，但考虑从 DB 刷新
-        case_df=st.session_state.case_df
-    elif 'case_df' in st.session_state and uploaded_case_file is None: 
-        del st.session_state['case_df']  # 释放旧的 case_df
-        case_df=pd.DataFrame()#设置一个空数组来防止定义报错
+    # 新上传的文件，或数据因内存预算被回收而需要重新载入
+    if uploaded_case_file is not None and (case_upload_id != st.session_state.get('case_upload_id') or (case_index is None and case_source != 'snapshot')):
+        # 在后台解析，完成前继续使用之前的病例数据
+        job = jobs.submit(session_id, '病例', case_upload_id, load_case_data, uploaded_case_file, session_id)
+        if job.state == 'done':
+            case_index = install_cases(job.result, 'upload')
+            st.session_state.case_upload_id = case_upload_id
+            finish_job(job)
+        elif job.state == 'failed':
+            fail_job(job, '病例文件载入失败')
+    elif case_index is None and case_source == 'snapshot':
+        # 快照数据被回收后直接从快照重新映射
+        load_snapshot(*st.session_state.case_snapshot, datasets=('病例',))
+        case_index = frame_store.get(session_id, 'case_index')
+    elif case_index is not None and uploaded_case_file is None and case_source == 'upload': 
+        frame_store.pop(session_id, 'case_index')  # 释放旧的病例数据
+        st.session_state.pop('case_upload_id', None)
+        case_index = None
         st.write("请上传 Excel 文件以继续") 
-    else:
+    elif case_index is None:
         st.write("请上传 Excel 文件以继续")
 
     
@@ -73,79 +394,401 @@ with tab3:
     
     uploaded_files = st.file_uploader("上传耗材使用文件(支持拖拽和文件选择)", type=["xlsx"], accept_multiple_files=True)  # 支持拖拽和文件选择
     #st.write(f"调试: uploaded_files 是 {uploaded_files} 和长度: {len(uploaded_files) if uploaded_files is not None else 'None'}")  # 添加这行
-    #st.write(f"调试: 'combined_df' 在 session state 中吗? {'combined_df' in st.session_state}")
+    consumable_upload_id = tuple(getattr(f, 'file_id', f.name) for f in uploaded_files or [])
+    consumable_index = frame_store.get(session_id, 'consumable_index')
+    consumable_source = st.session_state.get('consumable_source')
+    if len(consumable_upload_id) == 0:
+        jobs.pop(session_id, '耗材')  # 载入中途移除了上传文件，丢弃还没取走的任务
     
 
-    if 'combined_df' not in st.session_state and uploaded_files is not None and len(uploaded_files) > 0:
+    if len(consumable_upload_id) > 0 and (consumable_upload_id != st.session_state.get('consumable_upload_id') or (consumable_index is None and consumable_source != 'snapshot')):
         #st.write("调试: 进入了 if 块")  # 添加这行以确认
-        all_dataframes = []  # 用于存储所有上传的 DataFrame
+        uploads = {}
         for uploaded_filed in uploaded_files:
-            all_sheets = pd.read_excel(uploaded_filed, sheet_name=None)  # 读取所有工作表
-            for sheet, hdf in all_sheets.items():
-                all_dataframes.append(hdf)  # 将每个工作表的 DataFrame 添加到列表中
-                # 每读取一个工作表就写入数据库
-                hdf.to_sql('耗材详情', conn, if_exists='append', index=False)
+            uploads.setdefault(uploaded_digest(uploaded_filed), uploaded_filed)
+        incremental = consumable_index is not None and consumable_source == 'upload'
+
+        # 在后台同步，完成前继续使用之前的耗材数据
+        job = jobs.submit(
+            session_id, '耗材', consumable_upload_id, load_consumable_data,
+            uploads, consumable_index.frame if incremental else None,
+            st.session_state.get('consumable_files', ()), session_id,
+        )
+        if job.state == 'done':
+            result = job.result
+            if result['index'] is not None:
+                consumable_index = install_consumables(result['index'], 'upload')
+            st.session_state.consumable_files = result['files']
+            st.session_state.consumable_upload_id = consumable_upload_id
+            if result['added'] or result['removed']:
+                st.caption(f"新增 {result['added']} 个文件，移除 {result['removed']} 个文件")
+            finish_job(job)
+        elif job.state == 'failed':
+            fail_job(job, '耗材文件载入失败')
+    elif consumable_index is None and consumable_source == 'snapshot':
+        # 快照数据被回收后直接从快照重新映射
+        load_snapshot(*st.session_state.consumable_snapshot, datasets=('耗材',))
+        consumable_index = frame_store.get(session_id, 'consumable_index')
+    elif consumable_index is not None and len(consumable_upload_id) == 0 and consumable_source == 'upload':  
+        frame_store.pop(session_id, 'consumable_index')  # 如果没有上传文件，释放旧的耗材数据
+        with storage.connection(session_id) as conn:
+            remove_consumable_files(conn, list(ingested_files(conn)))
+        st.session_state.pop('consumable_upload_id', None)
+        st.session_state.pop('consumable_files', None)
+        consumable_index = None
+        st.write("请上传 Excel 文件以继续")
+    elif consumable_index is None:
+        st.write("请上传 Excel 文件以继续")
+
+
+with tab4:
+    snapshot_store = get_snapshots()
+    manifests = snapshot_store.list()
+    if manifests:
+        chosen = st.selectbox(
+            '选择历史快照',
+            manifests,
+            format_func=lambda m: f"{m['period']} v{m['version']}（{'、'.join(m['datasets'])}，{m['created']}）",
+        )
+        if st.button('加载快照'):
+            load_snapshot(chosen['period'], chosen['version'])
+            st.rerun()
+    else:
+        st.write('暂无快照')
+
+    snapshot_period = st.text_input('快照期间', value=time.strftime('%Y-%m'))
+    if st.button('保存当前数据为快照'):
+        frames = {
+            '病种': disease_data['df'] if disease_data is not None else None,
+            '病例': case_index.frame if case_index is not None else None,
+            '耗材': consumable_index.frame if consumable_index is not None else None,
+        }
+        if all(frame is None for frame in frames.values()):
+            st.write('没有可保存的数据')
+        else:
+            version = snapshot_store.save(snapshot_period, frames)
+            st.success(f'已保存快照 {snapshot_period} v{version}')
+
+
+@st.fragment(run_every=1)
+def ingest_progress():
+    # 后台载入进行中时每秒只刷新这一块；全部结束后整页重跑一次，把新数据换入
+    running = jobs.running(session_id)
+    if not running:
+        st.rerun()
+    for job in running:
+        st.progress(job.fraction, text=f'{job.name}：{job.message}，已载入 {job.rows} 行（{job.rows_per_second:,.0f} 行/秒）')
+
+
+def profiled(name):
+    """片段计时：随整页重跑时计入本次计时；片段单独重跑时另起一次计时并显示在片段内"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            global profiler
+            standalone = profiler.finished
+            if standalone:
+                profiler = Profiler(enabled=profiler.enabled)
+            with profiler.span(name):
+                result = fn(*args, **kwargs)
+            if standalone:
+                show_profile(fragment=name)
+            return result
+        return wrapper
+    return decorate
+
+
+def show_profile(**context):
+    if profiler.enabled:
+        # 本次重跑的阶段耗时，同时按会话追加到 JSON lines 日志
+        append_log(profiler.record(session_id, **context))
+        with st.expander(f'性能分析（本次重跑 {profiler.elapsed * 1000:.0f} ms）'):
+            st.dataframe(profiler.frame(), hide_index=True)
+    profiler.finish()
+
+
+# 以下各片段只依赖传入的参数，其中的控件变化时只重跑所在片段，不重跑侧边栏载入和其他图表
+
+@st.fragment
+@profiled('片段.额外排行')
+def more_losses_section(disease_key, profit_loss_summary):
+    #选择要额外显示的数量
+    extra_num=st.selectbox(
+        "选择要额外显示的数量",
+        (15,30,45,60)
         
-        combined_df = pd.concat(all_dataframes, ignore_index=True)  # 合并所有 DataFrame
+    )
+    if extra_num is not None:
+        with profiler.span('额外排行.构建图表'):
+            fig_more = cached_more_losses(disease_key, extra_num, profit_loss_summary)
+        with profiler.span('额外排行.plotly_chart'):
+            st.plotly_chart(fig_more)
+
+
+@st.fragment
+@profiled('片段.诊疗组详情')
+def group_section(disease_key, disease_cube, selected_disease, departments):
+    # 选择科室查看详情
+    selected_department = st.selectbox('选择科室查看详情', departments, key='department_select')
+    
+    if selected_department:  # 确保选择了科室
+        #以诊疗组来划分
+        group_details = disease_cube.groups(selected_disease, selected_department)
         
-        # 写入数据库（新添加）
-        # combined_df.to_sql('耗材详情', conn, if_exists='replace', index=False)  # 注释掉原来的批量写入
+        if group_details is not None:
+            if not group_details.empty:
+                with profiler.span('诊疗组饼图.构建图表'):
+                    fig_treatment_detail = cached_group_pie(disease_key, selected_disease, selected_department, group_details)
+                with profiler.span('诊疗组饼图.plotly_chart'):
+                    st.plotly_chart(fig_treatment_detail)
+            else:
+                st.write("选定科室没有有效的诊疗组数据")
+        else:
+            st.write("选定科室数据不完整或缺少必要列")
+
+
+@st.fragment
+@profiled('片段.文字显示')
+def summary_section(disease_cube, selected_disease):
+    if st.button('病种数据的文字显示'):
+        # 从 cube 取合计，不再扫描明细
+        with profiler.span('文字显示'):
+            for line in summary_text(disease_cube.totals(selected_disease)):
+                st.write(line)
+
+
+def show_consumables(consumable_index, name, key, label):
+    st.subheader(f'病人{name}的耗材使用')
+    # 按患者键（门诊号）和住院键 + 姓名直接取出该病人的耗材明细，不再扫描整张表
+    with profiler.span(f'耗材使用.查询{label}'):
+        filtered_data = consumable_index.lookup(key, name)
+    
+    
+    equip_columns = ['数量', 'AMT_HC', '医生姓名','项目名称']  # 更新列列表，包括新列
+    with profiler.span(f'耗材使用.dataframe {label}'):
+        paged_dataframe(filtered_data[equip_columns], key=f'consumable_table_{label}')
+    #计算使用每种耗材使用总和
+    if not filtered_data.empty:
+        with profiler.span(f'耗材使用.汇总{label}'):
+            summary = consumable_index.summary(key, name)
+        summary_columns = ['数量', 'AMT_HC总和', '使用医生','项目名称']
+        st.write("耗材使用统计结果：")
+        with profiler.span(f'耗材使用.dataframe {label}汇总'):
+            paged_dataframe(summary[summary_columns], key=f'consumable_summary_{label}')
+    else:
+        st.write("未找到该病例的耗材使用数据。")
+
+
+def session_frame(name):
+    """片段内按名称从共享内存预算取当前会话的数据
+
+    片段的参数会一直保存到会话下次整页重跑，所以片段只接收选择值等小参数，数据在片段内现取；
+    片段单独重跑时数据已被回收，则整页重跑一次，由侧边栏重新载入。
+    """
+    value = frame_store.get(session_id, name)
+    if value is None and profiler.finished and name in st.session_state.get('loaded_frames', ()):
+        st.rerun()
+    return value
+
+
+@st.fragment
+@profiled('片段.相似病例耗材')
+def similar_case_section(similar_cases):
+    # 相似病例的选择框和它的耗材明细放在同一个片段里，换一个相似病例只刷新这一栏
+    # similar_cases 为 {姓名: 病案号}，只有几十行
+    selected_similar_case=st.selectbox('选择相似病例以查看耗材使用',list(similar_cases))
+    if selected_similar_case:
+        consumable_index = session_frame('consumable_index')
+        if consumable_index is not None:
+            show_consumables(consumable_index, selected_similar_case, patient_key(similar_cases[selected_similar_case]), '相似病例')
+
+
+@st.fragment
+@profiled('片段.病例分析')
+def case_section(selected_disease):
+    case_index = session_frame('case_index')
+    consumable_index = session_frame('consumable_index')
+    sample_tab1,sample_tab2=st.tabs(["病例筛选","耗材使用"])#创建选项卡用于病例筛选、耗材使用
+    selected_case = None
+    
+    with sample_tab1:
+        if case_index is not None:
+            #选择病种
+
+            if selected_disease:
+                with profiler.span('病例筛选.取DRG病例'):
+                    case_DRG=case_index.drg(selected_disease)   #显示某种病例的预测盈亏情况
+                columns =['DRG编码','姓名', '分类','出院科别','实际住院天数','预测盈亏','DRG名称']
+                st.subheader(f'{selected_disease}')
+                with profiler.span('病例筛选.dataframe'):
+                    paged_dataframe(case_DRG[columns], key='case_table')  # 大 DRG 只发送当前页
+
+                # 选择病例
+                selected_case = st.selectbox('选择病例', case_DRG['姓名'])  # 假设病例名称在'病例名称'列
+                
+                
+                # 获取选定病例的分类和主要诊断
+                case_info = case_DRG[case_DRG['姓名'] == selected_case].iloc[0]
+                symptoms_code=patient_key(case_info['病案号'])  # 规范化为耗材表的患者键
+
+                similar_mode = st.radio('相似病例筛选方式', ['同分类同诊断', '全DRG最近邻'], horizontal=True)
+                if similar_mode == '同分类同诊断':
+                    # 相同分类和主要诊断、住院天数相差不超过4天的病人（索引内二分查找）
+                    with profiler.span('病例筛选.相似病例'):
+                        similar_patients = case_index.similar(case_info, window=4)
+                else:
+                    # 按住院天数、预测盈亏和费用列的标准化距离，在整个 DRG 内找最相似的病例
+                    neighbour_num = st.slider('最近邻数量', 5, 100, 20, step=5)
+                    with profiler.span('病例筛选.最近邻'):
+                        similar_patients = case_index.nearest(case_index.position(case_info), k=neighbour_num)
+                # 显示筛选结果
+                if not similar_patients.empty:
+                    st.write("筛选出住院天数的相似病人：")
+                    # 添加一列标记所选病人
+                    similar_patients_marked = similar_patients.assign(是否选中=similar_patients['姓名'] == selected_case)
+                    
+                    # 根据标记列进行排序，将所选病人放在第一位
+                    similar_patients_sorted = similar_patients_marked.sort_values(by='是否选中', ascending=False, kind='stable')
+
+                    # 选择要显示的字段
+                    selected_columns = ['病案号','姓名', '分类', '实际住院天数','出院科别','预测盈亏', '主要诊断名称','出院时间']
+                    if '相似距离' in similar_patients_sorted.columns:
+                        selected_columns.append('相似距离')
+                    with profiler.span('病例筛选.dataframe 相似病例'):
+                        st.dataframe(similar_patients_sorted[selected_columns],hide_index=True)  # 只显示选定的字段
+                else:
+                    st.write("没有找到相似的病人。")
+        else:
+            st.write('请上传病例文件以用于分析')
+
+    with sample_tab2:
         
-        # 现在从数据库读取并存储到 session state
-        st.session_state.combined_df = pd.read_sql('SELECT * FROM 耗材详情', conn)  # 从数据库读取数据并更新 session state
-    elif 'combined_df' in st.session_state and uploaded_files is not None and len(uploaded_files) > 0:
-        combined_df = st.session_state.combined_df  # 如果已经在 session state 中，并且有文件上传，使用它
-    elif 'combined_df' in st.session_state and uploaded_files is  not None and len(uploaded_files) == 0:  
-        del st.session_state['combined_df']  # 如果没有上传文件，释放旧的 combined_df
-        combined_df=pd.DataFrame()
-        st.write("请上传 Excel 文件以继续")
+        
+        
+        if consumable_index is not None:
+            
+            sample_col1,sample_col2=st.columns(2)
+            with sample_col1:
+                # 根据选择的病例过滤耗材使用数据
+                if selected_disease:
+                    if selected_case:
+                        show_consumables(consumable_index, selected_case, symptoms_code, '所选病例')
+            with sample_col2:
+                if selected_disease:
+                    if selected_case:
+                        rows = similar_patients.drop_duplicates('姓名')
+                        similar_case_section(dict(zip(rows['姓名'], rows['病案号'])))
+
+        else:
+            st.write('请上传耗材使用数据')
+
+
+# 病例 × 耗材的连接汇总：病例或耗材变化时在后台重建；同一份病例只增减耗材文件时只连接变化的文件
+consumable_usage = None
+if case_index is not None and consumable_index is not None:
+    case_token = st.session_state.get('case_upload_id') if st.session_state.get('case_source') == 'upload' else st.session_state.get('case_snapshot')
+    consumable_files = st.session_state.get('consumable_files') if st.session_state.get('consumable_source') == 'upload' else None
+    usage_token = (case_token, tuple(sorted(consumable_files)) if consumable_files is not None else st.session_state.get('consumable_snapshot'))
+    consumable_usage = frame_store.get(session_id, 'consumable_usage')
+    if consumable_usage is None or st.session_state.get('usage_token') != usage_token:
+        base, added, removed = None, [], []
+        incremental = (
+            consumable_usage is not None and consumable_files is not None
+            and st.session_state.get('usage_token', (None,))[0] == case_token
+            and '文件哈希' in consumable_index.frame.columns
+        )
+        if incremental:
+            base = consumable_usage
+            added = [digest for digest in consumable_files if digest not in base.files]
+            removed = [digest for digest in base.files if digest not in consumable_files]
+        # 完成前继续使用之前的汇总
+        job = jobs.submit(
+            session_id, '耗材分析', usage_token, load_usage,
+            case_index.frame, consumable_index.frame, base, added, removed,
+        )
+        if job.state == 'done':
+            frame_store.put(session_id, 'consumable_usage', job.result)
+            consumable_usage = frame_store.get(session_id, 'consumable_usage')
+            st.session_state.usage_token = usage_token
+            finish_job(job)
+        elif job.state == 'failed':
+            fail_job(job, '耗材分析失败')
+elif frame_store.get(session_id, 'consumable_usage') is not None:
+    frame_store.pop(session_id, 'consumable_usage')  # 病例或耗材已移除，释放旧的汇总
+    jobs.pop(session_id, '耗材分析')
+    st.session_state.pop('usage_token', None)
+
+if jobs.running(session_id):
+    with st.sidebar:
+        ingest_progress()
+
+
+@st.fragment
+@profiled('片段.耗材超标')
+def usage_section(selected_disease):
+    consumable_usage = session_frame('consumable_usage')
+    if consumable_usage is None:
+        st.write('请上传病例文件和耗材使用文件以用于分析')
+        return
+
+    scope_col, metric_col, num_col = st.columns([1, 1, 1])
+    with scope_col:
+        scope = st.radio('分析范围', ['DRG', '科室'], horizontal=True, key='usage_scope')
+    with metric_col:
+        by = st.selectbox('排序依据', ['超标金额', '金额', '例均金额', '数量', '使用病例数'], key='usage_metric')
+    with num_col:
+        top_num = st.slider('显示项目数', 5, 50, 20, step=5, key='usage_num')
+
+    drg = department = None
+    if scope == 'DRG':
+        drgs = consumable_usage.drgs()
+        drg_col, department_col = st.columns(2)
+        with drg_col:
+            # 默认跟随侧边栏选择的病种
+            drg = st.selectbox('选择DRG', drgs, index=drgs.index(selected_disease) if selected_disease in drgs else 0, key='usage_drg')
+        with department_col:
+            department = st.selectbox('选择科室', ['全部科室', *consumable_usage.departments(drg)], key='usage_drg_department')
+        if department == '全部科室':
+            department = None
+            st.caption('超标金额：各科室例均金额超出本 DRG 例均金额的部分之和')
+        else:
+            st.caption('超标金额：科室实际金额 - 科室病例数 × 本 DRG 例均金额')
     else:
-        st.write("请上传 Excel 文件以继续")
+        department = st.selectbox('选择科室', consumable_usage.departments(), key='usage_department')
+        st.caption('超标金额：按科室各 DRG 的病例数和 DRG 例均金额调整病种构成后的超出部分')
 
+    with profiler.span('耗材超标.排行'):
+        top_items = consumable_usage.top_items(drg, department, n=top_num, by=by)
+    if top_items.empty:
+        st.write('没有找到耗材使用数据。')
+        return
 
+    with profiler.span('耗材超标.plotly_chart'):
+        st.plotly_chart(overuse_figure(top_items, by, title=f'{drg or department}{"·" + department if drg and department else ""} 耗材项目排行'))
+    st.dataframe(top_items, hide_index=True)
+
+    if drg is not None:
+        # 选定项目在本 DRG 内按医生的使用情况
+        names = dict(zip(top_items['项目代码'], top_items['项目名称']))
+        item = st.selectbox('选择项目查看医生使用情况', top_items['项目代码'], format_func=lambda code: f'{code} {names.get(code) or ""}', key='usage_item')
+        with profiler.span('耗材超标.医生明细'):
+            st.dataframe(consumable_usage.doctors(drg, item), hide_index=True)
 
 
 # 主区域显示图表
-main_tab1,main_tab2=st.tabs(["病种分析","病例分析"])#
+main_tab1,main_tab2,main_tab3=st.tabs(["病种分析","病例分析","耗材超标分析"])#
 with main_tab1:
     
     disease_tab1,disease_tab2=st.tabs(["病种盈亏数据","病种科室诊疗组数据"])
     with disease_tab1:
         if 'df' in locals():  # 确保文件已上传
             st.header('亏损病种图表（正为亏损）')  # 添加主标题
-            # 显式确保 top15_losses 按 '耗材超标值' 降序排序
-            top15_losses_sorted = top15_losses.sort_values(by='耗材超标值', ascending=False)
-            fig = px.bar(
-                top15_losses_sorted, 
-                x='耗材超标值',
-                y='名称', 
-                orientation='h', 
-                title='亏损最多的前15位病种的耗材超标值（元）',
-                hover_data=['总例数'],
-                category_orders={'名称': top15_losses_sorted['名称'].tolist()}  # 新添加：指定 y 轴顺序
-            )
-            st.plotly_chart(fig)
+            with profiler.span('亏损排行.构建图表'):
+                fig = cached_top_losses(disease_key, 15, profit_loss_summary)
+            with profiler.span('亏损排行.plotly_chart'):
+                st.plotly_chart(fig)
             
-            #选择要额外显示的数量
-            extra_num=st.selectbox(
-                "选择要额外显示的数量",
-                (15,30,45,60)
-                
-            )
-            if extra_num is not None:
-                next15_losses = profit_loss_summary.nlargest(75, '耗材超标值').tail(extra_num)  # 获取额外的盈亏病种
-                next15_losses_sorted = next15_losses.sort_values(by='耗材超标值',ascending=False)#把耗材超标降序排列
-                fig_more = px.bar(
-                  next15_losses_sorted,
-                  x='耗材超标值', 
-                  y='名称', 
-                  orientation='h',
-                  height=30 *extra_num,
-                  title='亏损最多的第16-45位病种的耗材超标值（元）',
-                  hover_data=['总例数'],
-                  category_orders={'名称': next15_losses_sorted['名称'].tolist()} 
-                )
-                st.plotly_chart(fig_more)
+            more_losses_section(disease_key, profit_loss_summary)
             
             # Add copyable and searchable name list below the chart
 
@@ -157,57 +800,15 @@ with main_tab1:
             with col1:
                 st.subheader('病种科室详情')
                 if selected_disease:
-                    disease_df = df[df['名称'] == selected_disease]
                     st.write(f'{selected_disease}')
                     st.write('')
                     st.write('')
                     # 显示饼状图
-                    disease_details = disease_df.groupby('科室').agg(
-                        合计耗材=('合计均耗材(元)', 'sum'),
-                        总例数=('总例数', 'sum'),
-                        耗材超标值=('耗材超标值（元）','sum'),                    DRG=('DRG', 'first'),
-                    ).reset_index()
-                    
-                    # 饼状图显示逻辑
-                    custom_data = np.stack((
-                        disease_details['DRG'].values,
-                        disease_details['耗材超标值'].values,
-                        disease_details['总例数'].values
-                    ), axis=-1)
-                    
-                    #绘制饼图
-                    fig_detail = go.Figure(go.Pie(
-                        labels=disease_details['科室'],
-                        values=disease_details['合计耗材'],
-                        customdata=custom_data,
-                        hovertemplate=(
-                            "%{percent}<br>"+
-                            "科室: %{label}<br>" +
-                            "总例数: %{customdata[0][2]}<br>" +
-                            "DRG名称: %{customdata[0][0]}<br>" +
-                            "盈亏情况: %{customdata[0][1]}<extra></extra>"
-                        ),
-                        marker=dict(colors=px.colors.diverging.RdYlGn),
-                    ))
-                    
-                    fig_detail.update_layout(
-                        title={
-                            'text': f'{custom_data[0][0]} 的病种详情 总例数：{round(disease_details["总例数"].sum())}',
-                            'x': 0.4,
-                            'y': 0.97,
-                            'xanchor': 'center',
-                            'yanchor': 'top',
-                        },
-                        uniformtext_minsize=15,  # 文本信息最小值
-                        uniformtext_mode='hide', # 3种模式：[False, 'hide', 'show']
-                        
-                    )
-                    fig_detail.update_traces(
-                        textposition='inside',
-                        textinfo='percent+label',
-                    
-                    )
-                    st.plotly_chart(fig_detail)         #绘制饼状图
+                    with profiler.span('科室饼图.构建图表'):
+                        disease_details = disease_cube.departments(selected_disease)
+                        fig_detail = cached_department_pie(disease_key, selected_disease, disease_details)
+                    with profiler.span('科室饼图.plotly_chart'):
+                        st.plotly_chart(fig_detail)         #绘制饼状图
                 else:
                     st.write('请上传文件')
 
@@ -215,218 +816,26 @@ with main_tab1:
             with col2:
                 st.subheader('病种诊疗组详情')
                 if selected_disease:
-                    # 选择科室查看详情
-                    selected_department = st.selectbox('选择科室查看详情', disease_details['科室'], key='department_select')
-                    
-                    if selected_department:  # 确保选择了科室
-                        department_details = disease_df[disease_df['科室'] == selected_department]
-                        
-                        if not department_details.empty and '诊疗组' in department_details.columns:
-                            #以诊疗组来划分
-                            group_details = department_details.groupby('诊疗组').agg(
-                                合计耗材=('合计均耗材(元)', 'sum'),
-                                总例数=('总例数', 'sum'),         
-                                DRG=('DRG', 'first'),
-                                耗材超标值=('耗材超标值（元）','sum'),
-                            ).reset_index()
-                            
-                            
-                                
-                            depart_custom_data=np.stack((
-                                group_details['DRG'].values,
-                                group_details['耗材超标值'].values,
-                                group_details['总例数'].values
-                            ), axis=-1)
-
-
-                            if not group_details.empty:
-                                fig_treatment_detail = go.Figure(go.Pie(
-                                    labels=group_details['诊疗组'],
-                                    values=group_details['合计耗材'],
-                                    customdata=depart_custom_data,
-                                    hovertemplate=(
-                                        "诊疗组: %{label}<br>" +
-                                        "总例数: %{customdata[0][2]}<br>" +
-                                        "DRG:%{customdata[0][0]}<br>"+
-
-                                        "盈亏情况：%{customdata[0][1]}<br>"+
-                                        "<extra></extra>"
-                                    ),
-                                    marker=dict(colors=px.colors.sequential.Viridis),  # 使用颜色方案
-                                ))
-                                
-                                fig_treatment_detail.update_layout(
-                                    title={
-                                        'text': f'{selected_department} 的诊疗组详情',
-                                        'x': 0.5,
-                                        'y': 0.94,
-                                        'xanchor': 'center',
-                                        'yanchor': 'top'
-                                    },
-                                    uniformtext_minsize=15,  # 文本信息最小值
-                                    uniformtext_mode='hide',  # 3种模式：[False, 'hide', 'show']
-                                    transition_duration=500,  # 保持动画过渡
-                                )
-                                fig_treatment_detail.update_traces(
-                                    textposition='inside',
-                                    textinfo='percent+label',
-                                    
-                                )
-                                st.plotly_chart(fig_treatment_detail)
-                            else:
-                                st.write("选定科室没有有效的诊疗组数据")
-                        else:
-                            st.write("选定科室数据不完整或缺少必要列")
+                    group_section(disease_key, disease_cube, selected_disease, disease_details['科室'])
             
 
-            if st.button('病种数据的文字显示'):
-                cost=np.stack((
-                    disease_df['总费用（万元）'].sum(),
-                    disease_df['DRG费用（万元）'].sum(),
-                    disease_df['总例数'].sum(),
-                    disease_df['医保实际费用（万元）'].sum(),
-                    disease_df['合计均耗材(元)'].sum(),
-                    disease_df['合计耗材横向参考(元)'].sum(),
-                    disease_df['例均耗材横向参考（元）'].mean(),
-                    disease_df['耗材超标值（元）'].sum(),
-                ),axis=-1)
-
-                # 新添加：计算每个诊疗组的 (总例数 * 平均住院天数) 然后求总和
-                if '总例数' in disease_df.columns and '平均住院日（天）' in disease_df.columns:
-                        disease_df['乘积总和'] = disease_df['总例数'] * disease_df['平均住院日（天）']  # 为每个组计算乘积
-                        total_sum = disease_df['乘积总和'].sum()  # 对所有组求总和
-                        #st.write(f"所有诊疗组的 (总例数 * 平均住院天数) 总和: {total_sum}")  # 显示结果
-                average_days=total_sum/cost[2]
-                st.write(f'平均住院日{round(average_days,2)}天，总费用{round(cost[0],2)}万元，DRG费用{round(cost[1],2)}万元,\
-                医保实际费用{round(cost[3],2)}万元，支付率{round(cost[1]/cost[3]*100,2)}%')  # 显示总费用
-                st.write(f'总例数{cost[2]}例，例均耗材{round(cost[4]/cost[2],2)}元，例均耗材横向参考{round(cost[6],2)}，耗材超标比{round(cost[4]/cost[5],2)},'+
-                f'即每例亏损{round(cost[4]/cost[2]-cost[6],2)},总亏损{int(cost[7]//10000)}万{round(cost[7]%10000,2)}元'
-                )
+            if selected_disease:
+                summary_section(disease_cube, selected_disease)
                 
             
 with main_tab2:
-        sample_tab1,sample_tab2=st.tabs(["病例筛选","耗材使用"])#创建选项卡用于病例筛选、耗材使用
-        
-        with sample_tab1:
-            if 'case_df' in st.session_state:
-                case_df = st.session_state.case_df
-                #选择病种
+        case_section(selected_disease)
 
-                if selected_disease:
-                    case_DRG=case_df[case_df['DRG名称'] == selected_disease]   #显示某种病例的预测盈亏情况
-                    columns =['DRG编码','姓名', '分类','出院科别','实际住院天数','预测盈亏','DRG名称']
-                    st.subheader(f'{selected_disease}')
-                    st.dataframe(case_DRG[columns],hide_index=True)         
+with main_tab3:
+    usage_section(selected_disease)
 
-                    # 选择病例
-                    selected_case = st.selectbox('选择病例', case_DRG['姓名'])  # 假设病例名称在'病例名称'列
-                    
-                    
-                    # 获取选定病例的分类和主要诊断
-                    case_info = case_DRG[case_DRG['姓名'] == selected_case].iloc[0]
-                    classification = case_info['分类']  # 分类在
-                    primary_diagnosis = case_info['主要诊断名称']  # 主要诊断
-                    symptoms_code=case_info['病案号']#转换为字符串
-                    symptoms_code_numeric = pd.to_numeric(case_info['病案号'], errors='coerce')  # 转换为数字，处理无效值
-
-                    # 筛选相同分类和主要诊断的病人
-                    filtered_patients = case_DRG[
-                        (case_DRG['分类'] == classification) & 
-                        (case_DRG['主要诊断名称'] == primary_diagnosis)
-                    ]
-                    
-                    # 找出住院天数相差不到3天的病人
-                    selected_case_days = case_info['实际住院天数']  # 假设住院天数在'住院天数'列
-                    similar_patients = filtered_patients[
-                        (filtered_patients['实际住院天数'] >= selected_case_days - 4) & 
-                        (filtered_patients['实际住院天数'] <= selected_case_days + 4)
-                    ]
-                    selected_similar_case=st.selectbox('选择相似病例以查看耗材使用',similar_patients['姓名'])
-                    similar_case_info = case_DRG[case_DRG['姓名'] == selected_similar_case].iloc[0]
-                    symptoms_similar_code=str(similar_case_info['病案号'])
-                    symptoms_similar_numeric = pd.to_numeric(similar_case_info['病案号'], errors='coerce')  # 转换为数字，处理无效值
-                    # 显示筛选结果
-                    if not similar_patients.empty:
-                        st.write("筛选出住院天数的相似病人：")
-                        # 添加一列标记所选病人
-                        similar_patients['是否选中'] = similar_patients['姓名'] == selected_case
-                        
-                        # 根据标记列进行排序，将所选病人放在第一位
-                        similar_patients_sorted = similar_patients.sort_values(by='是否选中', ascending=False)
-
-                        # 选择要显示的字段
-                        selected_columns = ['病案号','姓名', '分类', '实际住院天数','出院科别','预测盈亏', '主要诊断名称','出院时间']
-                        st.dataframe(similar_patients_sorted[selected_columns],hide_index=True)  # 只显示选定的字段
-                    else:
-                        st.write("没有找到相似的病人。")
-            else:
-                st.write('请上传病例文件以用于分析')
-
-        with sample_tab2:
-            
-            
-            
-            if 'combined_df' in st.session_state and uploaded_files is not None and len(uploaded_files) > 0:
-                
-                sample_col1,sample_col2=st.columns(2)
-                with sample_col1:
-                    # 根据选择的病例过滤耗材使用数据
-                    if selected_disease:
-                        if selected_case:
-                            st.subheader(f'病人{selected_case}的耗材使用')
-                            filtered_data = combined_df[(combined_df['姓名'] == selected_case) &
-                            (combined_df['住院号'] == symptoms_code)|
-                            (pd.to_numeric(combined_df['门诊号'], errors='coerce') == symptoms_code_numeric)  # 转换并比较 '门诊号'
-                            ].dropna(subset=['门诊号'])  # 去除转换失败的行
-                            
-                            
-                            equip_columns = ['数量', 'AMT_HC', '医生姓名','项目名称']  # 更新列列表，包括新列
-                            st.dataframe(filtered_data[equip_columns],hide_index=True)
-                            #计算使用每种耗材使用总和
-                            if not filtered_data.empty:
-                                summary = filtered_data.groupby('项目代码').agg(
-                                    数量=('数量', 'sum'),
-                                    AMT_HC总和=('AMT_HC', 'sum'),
-                                    使用医生=('医生姓名', 'first'),
-                                    费用日期=('费用日期', 'first'),
-                                    项目名称=('项目名称', 'first'),
-                                    # 新添加：聚合新列
-                                ).reset_index()
-                                summary_columns = ['数量', 'AMT_HC总和', '使用医生','项目名称']
-                                st.write("耗材使用统计结果：")
-                                st.dataframe(summary[summary_columns],hide_index=True)
-                            else:
-                                st.write("未找到该病例的耗材使用数据。")
-                with sample_col2:
-                    if selected_disease:
-                        if selected_similar_case:
-                            st.subheader(f'病人{selected_similar_case}的耗材使用')
-                            #st.write(f'{symptoms_similar_numeric}')
-
-                            filtered_data = combined_df[(combined_df['姓名'] == selected_similar_case) &
-                            (combined_df['住院号'] == symptoms_similar_code)|
-                            (pd.to_numeric(combined_df['门诊号'], errors='coerce') == symptoms_similar_numeric)  # 转换并比较 '门诊号'
-                            ].dropna(subset=['门诊号'])  # 去除转换失败的行
-                            
-                            
-                            equip_columns = ['数量', 'AMT_HC', '医生姓名','项目名称']  # 更新列列表，包括新列
-                            st.dataframe(filtered_data[equip_columns],hide_index=True)
-                            #计算使用每种耗材使用总和
-                            if not filtered_data.empty:
-                                summary = filtered_data.groupby('项目代码').agg(
-                                    数量=('数量', 'sum'),
-                                    AMT_HC总和=('AMT_HC', 'sum'),
-                                    使用医生=('医生姓名', 'first'),
-                                    费用日期=('费用日期', 'first'),
-                                    项目名称=('项目名称', 'first'),
-                                    # 新添加：聚合新列
-                                ).reset_index()
-                                summary_columns = ['数量', 'AMT_HC总和', '使用医生','项目名称']
-                                st.write("耗材使用统计结果：")
-                                st.dataframe(summary[summary_columns],hide_index=True)
-                            else:  
-                                st.write("未找到该病例的耗材使用数据。")
 
-            else:
-                st.write('请上传耗材使用数据')
+# 片段保存的函数引用本次重跑的全局变量；整页重跑结束时去掉对会话数据的引用，
+# 会话闲置时共享内存预算才能真正回收这些数据。片段内用 session_frame 重新取
+st.session_state.loaded_frames = [
+    name for name in ('case_index', 'consumable_index', 'consumable_usage')
+    if frame_store.get(session_id, name) is not None
+]
+case_index = consumable_index = consumable_usage = result = None
 
+show_profile(disease=selected_disease)
@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+from sorted_runs import run_offsets
+
+
+LEVELS = ['名称', '科室', '诊疗组']
+
+# 需要求和的指标列
+SUM_COLUMNS = [
+    '合计均耗材(元)',
+    '总例数',
+    '耗材超标值（元）',
+    '总费用（万元）',
+    'DRG费用（万元）',
+    '医保实际费用（万元）',
+    '合计耗材横向参考(元)',
+]
+MEAN_COLUMN = '例均耗材横向参考（元）'  # 文字显示里取的是明细行的平均值
+DAYS_COLUMN = '平均住院日（天）'
+
+
+class DiseaseCube:
+    """按 (名称, 科室, 诊疗组) 预先汇总的病种数据
+
+    每次上传只构建一次；图表和文字显示都从这里取数，切换病种只是按偏移切片。
+    """
+
+    def __init__(self, df):
+        self.levels = [c for c in LEVELS if c in df.columns]
+        self.sum_columns = [c for c in SUM_COLUMNS if c in df.columns]
+
+        work = df[self.levels].copy()
+        for column in self.sum_columns:
+            work[column] = pd.to_numeric(df[column], errors='coerce')
+        aggregations = {column: (column, 'sum') for column in self.sum_columns}
+        if MEAN_COLUMN in df.columns:
+            work['_横向参考'] = pd.to_numeric(df[MEAN_COLUMN], errors='coerce')
+            aggregations['横向参考和'] = ('_横向参考', 'sum')
+            aggregations['横向参考数'] = ('_横向参考', 'count')
+        if '总例数' in df.columns and DAYS_COLUMN in df.columns:
+            # 每行的 (总例数 * 平均住院日)，用于计算加权平均住院日
+            work['_住院日乘积'] = (
+                work['总例数'].astype(float) * pd.to_numeric(df[DAYS_COLUMN], errors='coerce').astype(float)
+            )
+            aggregations['住院日乘积'] = ('_住院日乘积', 'sum')
+        if 'DRG' in df.columns:
+            work['DRG'] = df['DRG'].astype(object)  # category 列不支持 max
+            aggregations['DRG'] = ('DRG', 'first')
+            aggregations['DRG最大'] = ('DRG', 'max')
+
+        self.cube = (
+            work.groupby(self.levels, sort=True, dropna=False, observed=True)
+            .agg(**aggregations)
+            .reset_index()
+        )
+
+        # 记录每个病种在 cube 中的连续行范围
+        self._offsets = run_offsets(self.cube['名称'].to_numpy())
+
+    def __contains__(self, name):
+        return name in self._offsets
+
+    @property
+    def nbytes(self):
+        return int(self.cube.memory_usage(index=True, deep=True).sum())
+
+    def disease(self, name):
+        """某个病种在 cube 中的全部行"""
+        start, stop = self._offsets.get(name, (0, 0))
+        return self.cube.iloc[start:stop]
+
+    def name_summary(self):
+        """各病种的耗材超标值、总例数合计，供亏损排行使用"""
+        grouped = self.cube.groupby('名称', sort=True, observed=True)
+        summary = pd.DataFrame({
+            '耗材超标值': grouped['耗材超标值（元）'].sum(min_count=1),
+            '总例数': grouped['总例数'].sum(min_count=1),
+            'DRG': grouped['DRG最大'].max(),
+        }).reset_index()
+        return summary
+
+    def departments(self, name):
+        """某个病种按科室的汇总"""
+        return self.disease(name).groupby('科室', observed=True).agg(
+            合计耗材=('合计均耗材(元)', 'sum'),
+            总例数=('总例数', 'sum'),
+            耗材超标值=('耗材超标值（元）', 'sum'),
+            DRG=('DRG', 'first'),
+        ).reset_index()
+
+    def groups(self, name, department):
+        """某个病种、某个科室按诊疗组的汇总；没有诊疗组列时返回 None"""
+        if '诊疗组' not in self.levels:
+            return None
+        rows = self.disease(name)
+        rows = rows[rows['科室'] == department]
+        return rows.groupby('诊疗组', observed=True).agg(
+            合计耗材=('合计均耗材(元)', 'sum'),
+            总例数=('总例数', 'sum'),
+            DRG=('DRG', 'first'),
+            耗材超标值=('耗材超标值（元）', 'sum'),
+        ).reset_index()
+
+    def totals(self, name):
+        """文字显示用的病种合计"""
+        rows = self.disease(name)
+        totals = {column: rows[column].sum() for column in self.sum_columns}
+        if '横向参考和' in rows.columns:
+            count = rows['横向参考数'].sum()
+            totals[MEAN_COLUMN] = rows['横向参考和'].sum() / count if count else np.nan
+        if '住院日乘积' in rows.columns:
+            totals['住院日乘积'] = rows['住院日乘积'].sum()
+        return totals
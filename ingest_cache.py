@@ -0,0 +1,87 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+
+def content_hash(data):
+    """返回上传文件内容的 sha256 摘要，用作缓存键"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def frame_nbytes(value):
+    """估算缓存条目占用的字节数（DataFrame 按深度统计，其余递归求和）"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, dict):
+        return sum(frame_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(frame_nbytes(v) for v in value)
+    # numpy 数组以及提供 nbytes 属性的索引对象
+    nbytes = getattr(value, 'nbytes', None)
+    return int(nbytes) if nbytes is not None else 0
+
+
+class IngestCache:
+    """按内容哈希缓存解析结果，超过字节上限时按最近最少使用淘汰
+
+    Streamlit 的所有会话共用同一个进程，因此读写都加锁。
+    """
+
+    def __init__(self, max_bytes=1024 ** 3, max_entries=16):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # digest -> (value, nbytes)
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, digest):
+        with self._lock:
+            return digest in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def get(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            self._entries.move_to_end(digest)  # 标记为最近使用
+            return entry[0]
+
+    def put(self, digest, value):
+        size = frame_nbytes(value)
+        with self._lock:
+            old = self._entries.pop(digest, None)
+            if old is not None:
+                self._nbytes -= old[1]
+            self._entries[digest] = (value, size)
+            self._nbytes += size
+            # 至少保留刚放入的条目，即使它本身超过上限
+            while len(self._entries) > 1 and (
+                self._nbytes > self.max_bytes or len(self._entries) > self.max_entries
+            ):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._nbytes -= evicted
+        return value
+
+    def get_or_load(self, digest, loader):
+        """命中则直接返回，否则调用 loader() 解析并写入缓存"""
+        value = self.get(digest)
+        if value is None:
+            value = self.put(digest, loader())
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
@@ -0,0 +1,173 @@
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from profiling import Profiler
+
+
+WORKERS = int(os.environ.get('DRG_INGEST_WORKERS', 2))  # 0 表示在页面脚本内同步执行（调试用）
+
+
+class Job:
+    """一个后台载入任务的状态，工作线程写入，页面脚本只读
+
+    fn(job, *args) 在工作线程中执行，通过 job.update 报告进度，返回值放在 result；
+    不能在工作线程里调用 st.*，结果由页面脚本在任务完成后一次性换入。
+    """
+
+    def __init__(self, name, token):
+        self.name = name
+        self.token = token  # 同一份输入（内容哈希 / 上传 id）只提交一次
+        self.state = 'pending'  # pending / running / done / failed / cancelled
+        self.fraction = 0.0
+        self.rows = 0
+        self.message = '等待开始'
+        self.result = None
+        self.error = None
+        self.traceback = None
+        self.profiler = Profiler(enabled=True)  # 各阶段耗时，完成后可写入性能日志
+        self.started = None
+        self.finished = None
+        self.future = None  # 提交到线程池后的 Future，还没开始时可以取消
+
+    def span(self, name):
+        return self.profiler.span(name)
+
+    def update(self, fraction=None, rows=None, message=None):
+        if fraction is not None:
+            self.fraction = min(max(float(fraction), 0.0), 1.0)
+        if rows is not None:
+            self.rows = rows
+        if message is not None:
+            self.message = message
+
+    @property
+    def running(self):
+        return self.state in ('pending', 'running')
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def rows_per_second(self):
+        elapsed = self.elapsed
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    def _run(self, fn, args):
+        self.state = 'running'
+        self.started = time.time()
+        self.message = '正在载入'
+        try:
+            self.result = fn(self, *args)
+            self.fraction = 1.0
+            self.state = 'done'
+        except Exception as exc:
+            self.error = f'{type(exc).__name__}: {exc}'
+            self.traceback = traceback.format_exc()
+            self.state = 'failed'
+        finally:
+            self.finished = time.time()
+
+
+class JobManager:
+    """所有会话共用的后台载入线程池，每个会话每类数据同时只保留一个任务
+
+    输入变了而旧任务还在执行时，新任务等旧任务结束后再提交到线程池，两者不会同时写同一个会话库；
+    旧任务还没开始就直接取消。等待中的任务又被更新的输入取代时，只保留最新的一个。
+    """
+
+    def __init__(self, workers=WORKERS):
+        self.workers = workers
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='载入') if workers > 0 else None
+        self._jobs = {}  # (session_id, name) -> Job，页面脚本看到的最新任务
+        self._current = {}  # (session_id, name) -> 已提交到线程池、还没结束的 Job
+        self._waiting = {}  # (session_id, name) -> (Job, fn, args)，等 _current 结束后再提交
+        self._lock = threading.Lock()
+
+    def submit(self, session_id, name, token, fn, *args):
+        """提交任务；同一会话同类数据已有相同 token 的任务时直接返回它，不重复执行"""
+        key = (session_id, name)
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and job.token == token:
+                return job
+            if job is not None:
+                # 输入变了：旧任务还没开始就取消，已经在跑的继续跑完但结果不再使用
+                self._cancel(key, job)
+            job = Job(name, token)
+            self._jobs[key] = job
+            if key in self._current:
+                self._waiting[key] = (job, fn, args)
+                return job
+            self._current[key] = job
+        self._start(key, job, fn, args)
+        return job
+
+    def get(self, session_id, name):
+        with self._lock:
+            return self._jobs.get((session_id, name))
+
+    def pop(self, session_id, name):
+        """取走任务；还没开始的任务同时取消"""
+        key = (session_id, name)
+        with self._lock:
+            job = self._jobs.pop(key, None)
+            if job is not None:
+                self._cancel(key, job)
+            return job
+
+    def running(self, session_id):
+        with self._lock:
+            return [job for (sid, _), job in self._jobs.items() if sid == session_id and job.running]
+
+    def drop_session(self, session_id):
+        with self._lock:
+            for key in [key for key in self._jobs if key[0] == session_id]:
+                self._cancel(key, self._jobs.pop(key))
+
+    def _cancel(self, key, job):
+        # 调用方持有 self._lock；已经开始的任务无法中断，由 _finished 收尾
+        waiting = self._waiting.get(key)
+        if waiting is not None and waiting[0] is job:
+            del self._waiting[key]
+            job.state = 'cancelled'
+        elif job.future is not None and job.future.cancel():
+            job.state = 'cancelled'
+            if self._current.get(key) is job:
+                del self._current[key]
+                waiting = self._waiting.pop(key, None)
+                if waiting is not None:
+                    # 取消的任务不会再调用 _finished，等待的任务改为直接提交
+                    self._current[key] = waiting[0]
+                    self._submit(key, *waiting)
+
+    def _start(self, key, job, fn, args):
+        if self._pool is None:
+            self._execute(key, job, fn, args)
+        else:
+            self._submit(key, job, fn, args)
+
+    def _submit(self, key, job, fn, args):
+        job.future = self._pool.submit(self._execute, key, job, fn, args)
+
+    def _execute(self, key, job, fn, args):
+        try:
+            job._run(fn, args)
+        finally:
+            self._finished(key, job)
+
+    def _finished(self, key, job):
+        # 前一个任务写完数据库后，再提交等待中的任务
+        with self._lock:
+            if self._current.get(key) is job:
+                del self._current[key]
+            waiting = self._waiting.pop(key, None)
+            if waiting is not None:
+                self._current[key] = waiting[0]
+        if waiting is not None:
+            self._start(key, *waiting)
@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import OrderedDict
+
+from ingest_cache import frame_nbytes
+
+
+class SessionFrameStore:
+    """所有会话共用的数据存放处，总占用超过预算时回收最久未访问会话的数据
+
+    会话的 DataFrame / 索引不再放在 session_state 里，而是按 (会话, 名称) 存在这里；
+    被回收的会话下次访问时取不到数据，由页面从上传文件或快照重新载入。
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._sessions = OrderedDict()  # session_id -> {name: (value, nbytes)}，按最近访问排序
+        self._last_used = {}
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def touch(self, session_id):
+        with self._lock:
+            if session_id in self._sessions:
+                self._sessions.move_to_end(session_id)
+            self._last_used[session_id] = time.time()
+
+    def get(self, session_id, name):
+        with self._lock:
+            frames = self._sessions.get(session_id)
+            if frames is None or name not in frames:
+                return None
+            self._sessions.move_to_end(session_id)
+            self._last_used[session_id] = time.time()
+            return frames[name][0]
+
+    def put(self, session_id, name, value):
+        """存入数据后按预算回收其他会话；当前会话的数据不会被回收"""
+        size = frame_nbytes(value)
+        with self._lock:
+            frames = self._sessions.setdefault(session_id, {})
+            old = frames.pop(name, None)
+            if old is not None:
+                self._nbytes -= old[1]
+            frames[name] = (value, size)
+            self._nbytes += size
+            self._sessions.move_to_end(session_id)
+            self._last_used[session_id] = time.time()
+            evicted = self._evict(keep=session_id)
+        return evicted
+
+    def pop(self, session_id, name):
+        with self._lock:
+            frames = self._sessions.get(session_id)
+            if not frames or name not in frames:
+                return None
+            value, size = frames.pop(name)
+            self._nbytes -= size
+            if not frames:
+                del self._sessions[session_id]
+            return value
+
+    def drop_session(self, session_id):
+        with self._lock:
+            frames = self._sessions.pop(session_id, {})
+            self._nbytes -= sum(size for _, size in frames.values())
+            self._last_used.pop(session_id, None)
+
+    def drop_idle(self, ttl, now=None):
+        """释放超过 ttl 秒未访问的会话，返回被释放的会话"""
+        now = time.time() if now is None else now
+        with self._lock:
+            idle = [sid for sid, used in self._last_used.items() if now - used > ttl]
+        for session_id in idle:
+            self.drop_session(session_id)
+        return idle
+
+    def usage(self):
+        """各会话占用的字节数，按最近访问倒序"""
+        with self._lock:
+            return [
+                (sid, sum(size for _, size in frames.values()))
+                for sid, frames in reversed(self._sessions.items())
+            ]
+
+    def _evict(self, keep):
+        evicted = []
+        for session_id in list(self._sessions):
+            if self._nbytes <= self.max_bytes:
+                break
+            if session_id == keep:
+                continue
+            frames = self._sessions.pop(session_id)
+            self._nbytes -= sum(size for _, size in frames.values())
+            evicted.append(session_id)
+        return evicted
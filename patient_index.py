@@ -0,0 +1,136 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+from sorted_runs import run_offsets
+
+
+KEY_COLUMN = '患者键'  # 门诊号规范成的键，对应病案号
+INPATIENT_KEY = '住院键'  # 住院号规范成的键，需同时核对姓名
+
+
+def patient_key(value):
+    """把病案号/门诊号/住院号规范成统一的字符串键
+
+    数字（含 '000123'、123.0 这类写法）统一成整数字符串，其余去掉首尾空白；空值返回 None。
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, np.integer)) and not isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, (float, np.floating)):
+        if math.isnan(value):
+            return None
+        return str(int(value)) if float(value).is_integer() else str(value)
+    text = str(value).strip()
+    if not text:
+        return None
+    try:
+        number = float(text)
+    except ValueError:
+        return text
+    if math.isfinite(number) and number.is_integer():
+        return str(int(number))
+    return text
+
+
+def consumable_row_keys(outpatient_no, inpatient_no):
+    """耗材行的两个匹配键 (患者键, 住院键)
+
+    与原来的筛选条件一致：门诊号按数字等于病案号，或者住院号等于病案号且姓名相同，两者取并集。
+    患者键只取能转成数字的门诊号；门诊号为空的行两个键都为空，不参与匹配。
+    """
+    if outpatient_no is None or (isinstance(outpatient_no, float) and math.isnan(outpatient_no)):
+        return None, None
+    key = patient_key(outpatient_no)
+    try:
+        if not math.isfinite(float(key)):
+            key = None
+    except (TypeError, ValueError):
+        key = None
+    return key, patient_key(inpatient_no)
+
+
+def with_row_keys(frame):
+    """按现在的规则重算患者键和住院键，用于没有住院键的旧数据"""
+    inpatient = frame['住院号'] if '住院号' in frame.columns else [None] * len(frame)
+    keys = [consumable_row_keys(a, b) for a, b in zip(frame['门诊号'], inpatient)]
+    return frame.assign(**{
+        KEY_COLUMN: [key for key, _ in keys],
+        INPATIENT_KEY: [key for _, key in keys],
+    })
+
+
+def summarize_consumables(rows):
+    # 计算使用每种耗材使用总和
+    return rows.groupby('项目代码', observed=True).agg(
+        数量=('数量', 'sum'),
+        AMT_HC总和=('AMT_HC', 'sum'),
+        使用医生=('医生姓名', 'first'),
+        费用日期=('费用日期', 'first'),
+        项目名称=('项目名称', 'first'),
+    ).reset_index()
+
+
+class ConsumableIndex:
+    """按患者键分组的耗材明细索引
+
+    明细按患者键排好序后，每个患者对应一段连续行，查询只需按偏移切片；
+    另按住院键保存一份排好序的行号，查询时再核对姓名，与患者键的结果取并集。
+    """
+
+    def __init__(self, frame, key=KEY_COLUMN):
+        if INPATIENT_KEY not in frame.columns and '门诊号' in frame.columns:
+            frame = with_row_keys(frame)
+        keys = frame[key]
+        missing = keys.isna().to_numpy()
+        n_valid = len(keys) - int(missing.sum())
+        # 已按键排好序（空键在末尾）时直接使用，例如从快照或按索引顺序读回的数据
+        if missing[:n_valid].any() or not keys.iloc[:n_valid].is_monotonic_increasing:
+            frame = frame.sort_values(key, kind='stable', na_position='last')
+            keys = frame[key]
+        self.frame = frame if frame.index.equals(pd.RangeIndex(len(frame))) else frame.reset_index(drop=True)
+        self.key = key
+
+        self._offsets = run_offsets(keys.to_numpy()[:n_valid])  # 空键已排在末尾
+
+        # 住院键：行号按住院键排序，每个住院键对应其中一段
+        self._inpatient_order = np.empty(0, dtype=np.intp)
+        self._inpatient_offsets = {}
+        if INPATIENT_KEY in self.frame.columns and '姓名' in self.frame.columns:
+            inpatient = self.frame[INPATIENT_KEY]
+            valid = np.flatnonzero(inpatient.notna().to_numpy())
+            values = inpatient.to_numpy()[valid].astype(str)
+            order = np.argsort(values, kind='stable')
+            self._inpatient_order = valid[order]
+            self._inpatient_offsets = run_offsets(values[order])
+        self._summaries = {}
+
+    def __len__(self):
+        return len(self._offsets)
+
+    @property
+    def nbytes(self):
+        return int(self.frame.memory_usage(index=True, deep=True).sum())
+
+    def __contains__(self, key):
+        return key in self._offsets
+
+    def lookup(self, key, name=None):
+        """返回某个患者的全部耗材明细：门诊号匹配病案号的行，加上住院号匹配且姓名为 name 的行"""
+        start, stop = self._offsets.get(key, (0, 0))
+        if name is not None and key in self._inpatient_offsets:
+            first, last = self._inpatient_offsets[key]
+            candidates = self._inpatient_order[first:last]
+            candidates = candidates[self.frame['姓名'].to_numpy()[candidates] == name]
+            extra = candidates[(candidates < start) | (candidates >= stop)]
+            if len(extra):
+                return self.frame.iloc[np.union1d(np.arange(start, stop), extra)]
+        return self.frame.iloc[start:stop]
+
+    def summary(self, key, name=None):
+        """返回某个患者按项目代码汇总的耗材使用，结果按 (键, 姓名) 缓存"""
+        if (key, name) not in self._summaries:
+            self._summaries[(key, name)] = summarize_consumables(self.lookup(key, name))
+        return self._summaries[(key, name)]
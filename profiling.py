@@ -0,0 +1,106 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import pandas as pd
+
+from storage import DATA_DIR
+
+
+ENABLED = os.environ.get('DRG_PROFILE', '').lower() in ('1', 'true', 'yes')
+LOG_PATH = os.environ.get('DRG_PROFILE_LOG', os.path.join(DATA_DIR, 'profile.jsonl'))
+
+_log_lock = threading.Lock()
+_NULL_SPAN = nullcontext()
+
+
+class Profiler:
+    """一次页面重跑内各阶段的计时
+
+    关闭时 span() 返回同一个空上下文，几乎没有开销；开启时记录每个阶段的开始时刻、耗时和嵌套层级。
+    """
+
+    def __init__(self, enabled=ENABLED):
+        self.enabled = enabled
+        self.spans = []  # [(阶段, 层级, 开始秒, 耗时秒)]
+        self._depth = 0
+        self._started = time.perf_counter()
+        self.finished = False  # 本次重跑已结束；之后的片段单独重跑需另起一次计时
+
+    def span(self, name):
+        return self._span(name) if self.enabled else _NULL_SPAN
+
+    @contextmanager
+    def _span(self, name):
+        index = len(self.spans)
+        self.spans.append((name, self._depth, time.perf_counter() - self._started, None))
+        self._depth += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            name, depth, offset, _ = self.spans[index]
+            self.spans[index] = (name, depth, offset, time.perf_counter() - started)
+
+    def finish(self):
+        self.finished = True
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self._started
+
+    def frame(self):
+        """计时明细表，子阶段按层级缩进"""
+        return pd.DataFrame({
+            '阶段': ['　' * depth + name for name, depth, _, _ in self.spans],
+            '开始(ms)': [round(offset * 1000, 1) for _, _, offset, _ in self.spans],
+            '耗时(ms)': [round((seconds or 0) * 1000, 1) for _, _, _, seconds in self.spans],
+        })
+
+    def record(self, session_id, **context):
+        """写入日志的一条记录"""
+        return {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'session': session_id,
+            'total_ms': round(self.elapsed * 1000, 1),
+            'spans': [
+                {'name': name, 'depth': depth, 'start_ms': round(offset * 1000, 1), 'ms': round((seconds or 0) * 1000, 1)}
+                for name, depth, offset, seconds in self.spans
+            ],
+            **context,
+        }
+
+
+def append_log(record, path=LOG_PATH):
+    """以 JSON lines 追加一条计时记录，多个会话并发写入时加锁"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    with _log_lock, open(path, 'a', encoding='utf-8') as f:
+        f.write(line + '\n')
+
+
+def slowest_stages(path=LOG_PATH, top=20):
+    """汇总日志中各阶段的耗时，按 p95 倒序，用于找出实际使用中最慢的路径"""
+    rows = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            rows.extend((span['name'], span['ms']) for span in record['spans'])
+    if not rows:
+        return pd.DataFrame(columns=['阶段', '次数', '中位(ms)', 'p95(ms)', '最大(ms)', '合计(ms)'])
+    spans = pd.DataFrame(rows, columns=['阶段', 'ms'])
+    summary = spans.groupby('阶段')['ms'].agg(
+        次数='count',
+        **{'中位(ms)': 'median', 'p95(ms)': lambda s: s.quantile(0.95), '最大(ms)': 'max', '合计(ms)': 'sum'},
+    ).reset_index()
+    return summary.sort_values('p95(ms)', ascending=False).head(top)
+
+
+if __name__ == '__main__':
+    import sys
+
+    pd.set_option('display.width', 200)
+    print(slowest_stages(sys.argv[1] if len(sys.argv) > 1 else LOG_PATH).to_string(index=False))
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+
+# 各数据集在页面中实际用到的列，其余列入库后不再放进内存
+USED_COLUMNS = {
+    '病种': [
+        '名称', 'DRG', '科室', '诊疗组',
+        '合计均耗材(元)', '总例数', '耗材超标值（元）', '总费用（万元）', 'DRG费用（万元）',
+        '医保实际费用（万元）', '合计耗材横向参考(元)', '例均耗材横向参考（元）', '平均住院日（天）',
+    ],
+    '病例': [
+        'DRG编码', 'DRG名称', '姓名', '病案号', '分类', '出院科别', '实际住院天数',
+        '预测盈亏', '主要诊断名称', '出院时间',
+    ],
+    '耗材': [
+        '姓名', '住院号', '门诊号', '项目代码', '项目名称', '数量', 'AMT_HC', '医生姓名',
+        '费用日期', '患者键', '住院键', '文件哈希',
+    ],
+}
+
+# 取值大量重复的文本列，转成 category 只保存一份字符串
+CATEGORY_COLUMNS = {
+    '病种': ['名称', 'DRG', '科室', '诊疗组'],
+    '病例': ['DRG编码', 'DRG名称', '分类', '出院科别', '主要诊断名称'],
+    '耗材': ['项目代码', '项目名称', '医生姓名', '文件哈希'],
+}
+
+MAX_CATEGORY_RATIO = 0.5  # 不同取值超过行数一半时转 category 反而更占内存
+
+
+def used_columns(dataset, columns):
+    """数据集实际需要保留的列；病例另外保留所有费用列，供最近邻检索使用"""
+    keep = [c for c in USED_COLUMNS[dataset] if c in columns]
+    if dataset == '病例':
+        keep += [c for c in columns if '费' in str(c) and c not in keep]
+    return keep
+
+
+def select_columns_sql(conn, table, dataset):
+    """SELECT 子句的列清单：只读数据集用到的列"""
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+    return ', '.join(f'"{c}"' for c in used_columns(dataset, columns))
+
+
+def _downcast(series):
+    if pd.api.types.is_bool_dtype(series):
+        return series
+    if pd.api.types.is_integer_dtype(series) and series.dtype != np.int64:
+        # 例数、住院天数会参与乘法和加减，int8/int16 会静默溢出，统一用 int64
+        return series.astype(np.int64)
+    if pd.api.types.is_float_dtype(series) and series.dtype != np.float64:
+        # 金额、费用列都要参与求和，统一用 float64；float32 逐个值无损，但累加成千上万行后会丢精度
+        return series.astype(np.float64)
+    return series
+
+
+def is_compact(df, dataset):
+    """df 是否已经是 compact 的结果（例如快照读回的数据）：只有用到的列，且没有旧版留下的窄数值列"""
+    narrow = [
+        dtype for dtype in df.dtypes
+        if (pd.api.types.is_integer_dtype(dtype) or pd.api.types.is_float_dtype(dtype))
+        and not pd.api.types.is_bool_dtype(dtype) and dtype.itemsize < 8
+    ]
+    return list(df.columns) == used_columns(dataset, df.columns) and not narrow
+
+
+def compact(df, dataset):
+    """去掉不用的列，重复文本转 category，数值列统一为 int64 / float64"""
+    df = df[used_columns(dataset, df.columns)].copy()
+    for column in df.columns:
+        series = df[column]
+        if column in CATEGORY_COLUMNS[dataset] and series.dtype == object:
+            if len(series) and series.nunique(dropna=True) <= len(series) * MAX_CATEGORY_RATIO:
+                df[column] = series.astype('category')
+        else:
+            df[column] = _downcast(series)
+    return df
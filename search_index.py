@@ -0,0 +1,123 @@
+from itertools import islice, product
+
+try:
+    from pypinyin import Style, pinyin
+except ImportError:  # 未安装 pypinyin 时不支持拼音首字母检索
+    pinyin = None
+
+
+MAX_INITIAL_VARIANTS = 8  # 多音字组合的上限
+
+
+def pinyin_initials(text):
+    """返回名称的拼音首字母串（小写），多音字会产生多个候选，例如 '重症' -> ['zz', 'cz']"""
+    if pinyin is None or not text:
+        return []
+    choices = [
+        list(dict.fromkeys(item.lower() for item in items))
+        for items in pinyin(text, style=Style.FIRST_LETTER, heteronym=True, errors='default')
+    ]
+    return [''.join(parts) for parts in islice(product(*choices), MAX_INITIAL_VARIANTS)]
+
+
+def ngrams(text, n=2):
+    if len(text) < n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class NameSearchIndex:
+    """病种名称检索索引：支持子串、字符 n-gram 模糊匹配和拼音首字母，按匹配程度排序
+
+    每次上传构建一次，检索时先用倒排表取候选，再逐个确认。
+    """
+
+    def __init__(self, names, codes=None):
+        codes = list(codes) if codes is not None else [None] * len(names)
+        self.names = []
+        self._fields = []  # 每个名称的 (名称, DRG编码, [拼音首字母...])，均为小写
+        seen = set()
+        for name, code in zip(names, codes):
+            if not isinstance(name, str) or name in seen:
+                continue
+            seen.add(name)
+            self.names.append(name)
+            code = str(code).lower() if isinstance(code, str) and code else ''
+            self._fields.append((name.lower(), code, pinyin_initials(name)))
+
+        # 单字和二元组倒排表，三个字段合并建表
+        self._chars = {}
+        self._bigrams = {}
+        for i, (name, code, initials) in enumerate(self._fields):
+            for text in (name, code, *initials):
+                for char in set(text):
+                    self._chars.setdefault(char, set()).add(i)
+                for gram in ngrams(text):
+                    self._bigrams.setdefault(gram, set()).add(i)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _candidates(self, query):
+        # 子串必然包含查询的全部二元组，取交集即可得到候选
+        if len(query) == 1:
+            return self._chars.get(query, set())
+        postings = [self._bigrams.get(gram) for gram in ngrams(query)]
+        if any(p is None for p in postings):
+            return set()
+        postings.sort(key=len)
+        return set.intersection(*postings)
+
+    @staticmethod
+    def _rank(query, fields):
+        """越小越靠前：完全匹配 < 前缀 < 子串 < 拼音首字母 < 编码子串"""
+        name, code, initials = fields
+        if query == name or query == code:
+            return (0, 0)
+        if name.startswith(query):
+            return (1, 0)
+        if code.startswith(query):
+            return (1, 1)
+        position = name.find(query)
+        if position >= 0:
+            return (2, position)
+        for text in initials:
+            if text.startswith(query):
+                return (3, 0)
+        for text in initials:
+            position = text.find(query)
+            if position >= 0:
+                return (4, position)
+        if query in code:
+            return (5, code.find(query))
+        return None
+
+    def search(self, query, limit=None, min_overlap=0.5):
+        """返回按相关度排序的名称列表
+
+        没有子串/首字母命中时，退回按二元组重合比例的模糊匹配（至少 min_overlap）。
+        """
+        query = query.strip().lower()
+        if not query:
+            return list(self.names)
+
+        ranked = []
+        for i in self._candidates(query):
+            rank = self._rank(query, self._fields[i])
+            if rank is not None:
+                ranked.append((rank, len(self.names[i]), i))
+
+        if not ranked and len(query) > 1:
+            grams = ngrams(query)
+            overlap = {}
+            for gram in grams:
+                for i in self._bigrams.get(gram, ()):
+                    overlap[i] = overlap.get(i, 0) + 1
+            for i, hits in overlap.items():
+                score = hits / len(grams)
+                if score >= min_overlap:
+                    ranked.append(((6, -score), len(self.names[i]), i))
+
+        ranked.sort()
+        result = [self.names[i] for _, _, i in ranked]
+        return result[:limit] if limit is not None else result
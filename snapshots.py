@@ -0,0 +1,144 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+import pyarrow as pa
+
+
+SNAPSHOT_DIR = os.environ.get('DRG_SNAPSHOT_DIR', 'snapshots')
+DATASETS = ('病种', '病例', '耗材')
+MANIFEST = 'manifest.json'
+
+_VERSION_DIR = re.compile(r'^v(\d+)$')
+
+
+def _to_table(df):
+    """DataFrame 转 Arrow 表；混有数字和文本的 object 列统一转成文本"""
+    df = df.reset_index(drop=True)
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        pass
+    df = df.copy()
+    for column in df.columns:
+        if df[column].dtype != object:
+            continue
+        try:
+            pa.array(df[column], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            df[column] = df[column].map(lambda v: v if pd.isna(v) else str(v))
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def write_arrow(df, path):
+    # 不压缩的 Arrow IPC 文件才能直接内存映射读取
+    table = _to_table(df)
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return table.num_rows
+
+
+def read_arrow(path):
+    """内存映射打开快照，数值列直接引用映射的页面，不整体读入内存"""
+    source = pa.memory_map(path, 'r')
+    table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+class SnapshotStore:
+    """按统计期间和版本号保存的列式快照
+
+    目录结构为 <root>/<期间>/v<版本>/{病种,病例,耗材}.arrow 加 manifest.json；
+    同一期间每次保存生成新版本，旧版本保留。
+    """
+
+    def __init__(self, root=SNAPSHOT_DIR):
+        self.root = root
+
+    def _period_dir(self, period):
+        period = str(period).strip()
+        if not period or os.sep in period or period in ('.', '..'):
+            raise ValueError(f'无效的快照期间: {period!r}')
+        return os.path.join(self.root, period)
+
+    def versions(self, period):
+        period_dir = self._period_dir(period)
+        if not os.path.isdir(period_dir):
+            return []
+        found = []
+        for name in os.listdir(period_dir):
+            match = _VERSION_DIR.match(name)
+            if match and os.path.exists(os.path.join(period_dir, name, MANIFEST)):
+                found.append(int(match.group(1)))
+        return sorted(found)
+
+    def save(self, period, frames):
+        """保存一组数据集（名称 -> DataFrame），返回新版本号"""
+        period_dir = self._period_dir(period)
+        os.makedirs(period_dir, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix='.staging_', dir=period_dir)
+        try:
+            datasets = {}
+            for name, df in frames.items():
+                if df is None:
+                    continue
+                rows = write_arrow(df, os.path.join(staging, f'{name}.arrow'))
+                datasets[name] = {'rows': rows, 'columns': [str(c) for c in df.columns]}
+            # 写完所有文件后再改名，其他会话不会看到写了一半的快照
+            while True:
+                version = (self.versions(period) or [0])[-1] + 1
+                manifest = {
+                    'period': str(period),
+                    'version': version,
+                    'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                    'datasets': datasets,
+                }
+                with open(os.path.join(staging, MANIFEST), 'w', encoding='utf-8') as f:
+                    json.dump(manifest, f, ensure_ascii=False, indent=2)
+                try:
+                    os.rename(staging, os.path.join(period_dir, f'v{version}'))
+                    return version
+                except OSError:
+                    if not os.path.exists(os.path.join(period_dir, f'v{version}')):
+                        raise
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+    def list(self):
+        """全部快照的 manifest，按期间、版本倒序"""
+        if not os.path.isdir(self.root):
+            return []
+        manifests = []
+        for period in os.listdir(self.root):
+            if not os.path.isdir(os.path.join(self.root, period)):
+                continue
+            for version in self.versions(period):
+                with open(os.path.join(self.root, period, f'v{version}', MANIFEST), encoding='utf-8') as f:
+                    manifests.append(json.load(f))
+        manifests.sort(key=lambda m: (m['period'], m['version']), reverse=True)
+        return manifests
+
+    def _version_dir(self, period, version=None):
+        if version is None:
+            versions = self.versions(period)
+            if not versions:
+                raise FileNotFoundError(f'没有 {period} 的快照')
+            version = versions[-1]
+        return os.path.join(self._period_dir(period), f'v{version}')
+
+    def manifest(self, period, version=None):
+        with open(os.path.join(self._version_dir(period, version), MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+
+    def load(self, period, version=None, datasets=None):
+        """读取快照，返回 名称 -> DataFrame；version 为空时取最新版本"""
+        version_dir = self._version_dir(period, version)
+        manifest = self.manifest(period, version)
+        names = manifest['datasets'] if datasets is None else [n for n in datasets if n in manifest['datasets']]
+        return {name: read_arrow(os.path.join(version_dir, f'{name}.arrow')) for name in names}
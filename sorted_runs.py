@@ -0,0 +1,20 @@
+import numpy as np
+
+
+def run_bounds(*keys):
+    """keys 为若干等长、已排好序的数组，返回每段相同键的 (starts, stops)"""
+    n = len(keys[0])
+    if n == 0:
+        return np.array([], dtype=int), np.array([], dtype=int)
+    change = np.zeros(n - 1, dtype=bool)
+    for values in keys:
+        change |= values[1:] != values[:-1]
+    starts = np.flatnonzero(np.r_[True, change])
+    stops = np.r_[starts[1:], n]
+    return starts, stops
+
+
+def run_offsets(values):
+    """values 已排好序，返回 {取值: (起, 止)}"""
+    starts, stops = run_bounds(values)
+    return dict(zip(values[starts], zip(starts.tolist(), stops.tolist())))
@@ -0,0 +1,159 @@
+import glob
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+DATA_DIR = os.environ.get('DRG_DATA_DIR', '.drg_sessions')
+POOL_SIZE = 4
+SESSION_TTL = 6 * 3600  # 会话超过这么久没有访问，其数据库会被清理
+CLEANUP_INTERVAL = 600
+
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',  # 读写互不阻塞
+    'PRAGMA synchronous=NORMAL',  # WAL 模式下足够安全，写入快得多
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-65536',  # 64 MB 页缓存
+    'PRAGMA mmap_size=268435456',  # 256 MB 内存映射读
+    'PRAGMA busy_timeout=5000',
+)
+
+
+def connect(path):
+    """打开一个可跨线程使用的连接并设置 WAL 等参数"""
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    """单个数据库文件的连接池，同一连接同一时刻只借给一个线程"""
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()  # 出错时不把未完成的事务留给下一个使用者
+            raise
+        finally:
+            self._release(conn)
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return connect(self.path)
+        return self._idle.get()  # 连接都在使用中时等待归还
+
+    def _release(self, conn):
+        if self._closed:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class SessionStorage:
+    """按会话隔离的 SQLite 存储：每个会话一个数据库文件，各自一个连接池
+
+    不同分析人员的数据互不覆盖，也不会争用同一个库的写锁；长时间无人访问的会话库会被删除。
+    """
+
+    def __init__(self, data_dir=DATA_DIR, ttl=SESSION_TTL, pool_size=POOL_SIZE):
+        self.data_dir = data_dir
+        self.ttl = ttl
+        self.pool_size = pool_size
+        self._pools = {}
+        self._last_used = {}
+        self._lock = threading.Lock()
+        self._last_cleanup = 0.0
+        os.makedirs(data_dir, exist_ok=True)
+
+    def path(self, session_id):
+        return os.path.join(self.data_dir, f'{session_id}.db')
+
+    def pool(self, session_id):
+        with self._lock:
+            pool = self._pools.get(session_id)
+            if pool is None:
+                pool = self._pools[session_id] = ConnectionPool(self.path(session_id), self.pool_size)
+            self._last_used[session_id] = time.time()
+        self._maybe_cleanup()
+        return pool
+
+    def connection(self, session_id):
+        return self.pool(session_id).connection()
+
+    def touch(self, session_id):
+        """记录会话仍在使用；页面每次重跑都调用，只查看数据、不上传文件的会话也不会被当作过期清理
+
+        返回本次顺带清理掉的过期会话。
+        """
+        with self._lock:
+            self._last_used[session_id] = time.time()
+        return self._maybe_cleanup()
+
+    def drop(self, session_id):
+        """关闭会话的连接池并删除其数据库文件"""
+        with self._lock:
+            pool = self._pools.pop(session_id, None)
+            self._last_used.pop(session_id, None)
+        if pool is not None:
+            pool.close()
+        for path in glob.glob(self.path(session_id) + '*'):  # 连同 -wal / -shm
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def cleanup(self, now=None):
+        """删除超过 ttl 未访问的会话库，包括进程重启前遗留的文件"""
+        now = time.time() if now is None else now
+        with self._lock:
+            idle = [sid for sid, used in self._last_used.items() if now - used > self.ttl]
+            active = set(self._last_used) - set(idle)
+        for session_id in idle:
+            self.drop(session_id)
+        for path in glob.glob(os.path.join(self.data_dir, '*.db')):
+            session_id = os.path.basename(path)[:-3]
+            if session_id in active:
+                continue
+            try:
+                stale = now - os.path.getmtime(path) > self.ttl
+            except OSError:
+                continue
+            if stale:
+                self.drop(session_id)
+        return idle
+
+    def _maybe_cleanup(self):
+        now = time.time()
+        if now - self._last_cleanup < CLEANUP_INTERVAL:
+            return []
+        self._last_cleanup = now
+        return self.cleanup(now)
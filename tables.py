@@ -0,0 +1,49 @@
+import streamlit as st
+
+
+PAGE_SIZE = 50  # 每页发送到浏览器的行数
+ORIGINAL_ORDER = '（原顺序）'
+
+
+def page_positions(frame, sort_by=None, descending=False, page=1, page_size=PAGE_SIZE):
+    """排序后第 page 页（从 1 开始）在 frame 中的行号；只对排序列排序，不复制整张表"""
+    start = (page - 1) * page_size
+    stop = min(start + page_size, len(frame))
+    if sort_by is None:
+        return list(range(start, stop))
+    values = frame[sort_by].reset_index(drop=True)
+    try:
+        ordered = values.sort_values(ascending=not descending, kind='stable', na_position='last')
+    except TypeError:
+        # 数字和文本混在一列时按文本排序
+        ordered = values.astype(str).where(values.notna()).sort_values(
+            ascending=not descending, kind='stable', na_position='last')
+    return ordered.index[start:stop].tolist()
+
+
+def paged_dataframe(frame, key, page_size=PAGE_SIZE):
+    """分页表格：排序和分页在服务端完成，每次只把当前页发送到浏览器
+
+    行数不超过一页时与 st.dataframe 相同，不显示分页控件。key 用于区分同一页面上的多个表格。
+    """
+    if len(frame) <= page_size:
+        st.dataframe(frame, hide_index=True)
+        return
+
+    pages = -(-len(frame) // page_size)
+    page_key = f'{key}_page'
+    if st.session_state.get(page_key, 1) > pages:
+        st.session_state[page_key] = 1  # 换了数据后页数变少，回到第一页
+
+    sort_col, order_col, page_col = st.columns([2, 1, 1])
+    with sort_col:
+        sort_by = st.selectbox('排序列', [ORIGINAL_ORDER, *frame.columns], key=f'{key}_sort')
+    with order_col:
+        descending = st.toggle('降序', key=f'{key}_desc')
+    with page_col:
+        page = st.number_input('页码', min_value=1, max_value=pages, step=1, key=page_key)
+
+    positions = page_positions(frame, None if sort_by == ORIGINAL_ORDER else sort_by, descending, page, page_size)
+    st.dataframe(frame.iloc[positions], hide_index=True)
+    st.caption(f'共 {len(frame)} 行，第 {page}/{pages} 页')
+
@@ -0,0 +1,70 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from case_index import CaseIndex  # noqa: E402
+from charts import summary_text  # noqa: E402
+from disease_cube import DiseaseCube  # noqa: E402
+from schema import compact, is_compact  # noqa: E402
+
+
+def disease_frame(dtype):
+    # 总例数、平均住院日都是整数列：int8 相乘 100 * 10 会溢出
+    return pd.DataFrame({
+        '名称': ['病种A', '病种A'],
+        'DRG': ['A1', 'A1'],
+        '科室': ['内科', '外科'],
+        '诊疗组': ['一组', '二组'],
+        '合计均耗材(元)': [1000.0, 500.0],
+        '总例数': np.array([100, 50], dtype=dtype),
+        '耗材超标值（元）': [10.0, 20.0],
+        '总费用（万元）': [1.0, 2.0],
+        'DRG费用（万元）': [1.0, 2.0],
+        '医保实际费用（万元）': [1.0, 2.0],
+        '合计耗材横向参考(元)': [800.0, 400.0],
+        '例均耗材横向参考（元）': [8.0, 8.0],
+        '平均住院日（天）': np.array([10, 8], dtype=dtype),
+    })
+
+
+def case_frame(dtype):
+    return pd.DataFrame({
+        'DRG编码': ['A1'] * 3,
+        'DRG名称': ['病种A'] * 3,
+        '姓名': ['甲', '乙', '丙'],
+        '病案号': [1, 2, 3],
+        '分类': ['A'] * 3,
+        '出院科别': ['内科'] * 3,
+        '实际住院天数': np.array([126, 124, 10], dtype=dtype),
+        '预测盈亏': [1.0, 2.0, 3.0],
+        '主要诊断名称': ['肺炎'] * 3,
+        '出院时间': ['2024-01-01'] * 3,
+    })
+
+
+def test_compact_keeps_integer_columns_wide():
+    df = compact(disease_frame(np.int8), '病种')
+    assert df['总例数'].dtype == np.int64
+    assert df['平均住院日（天）'].dtype == np.int64
+    assert is_compact(df, '病种')
+    assert not is_compact(disease_frame(np.int8)[df.columns], '病种')
+
+
+def test_weighted_days_with_integer_columns():
+    for dtype in (np.int8, np.int16, np.int64):
+        for df in (disease_frame(dtype), compact(disease_frame(dtype), '病种')):
+            totals = DiseaseCube(df).totals('病种A')
+            assert totals['住院日乘积'] == 1400
+            assert '平均住院日9.33天' in summary_text(totals)[0]
+
+
+def test_similar_cases_with_integer_days():
+    for dtype in (np.int8, np.int64):
+        for df in (case_frame(dtype), compact(case_frame(dtype), '病例')):
+            index = CaseIndex(df)
+            case = index.frame.iloc[0]
+            assert sorted(index.similar(case, window=4)['实际住院天数'].tolist()) == [124, 126]